@@ -0,0 +1,248 @@
+# legacy_app/bot/admission.py
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from legacy_app.core.config import settings
+from legacy_app.db import crud
+from legacy_app.db.database import SessionLocal
+
+class ControleDeAdmissao:
+    """
+    Contrapressão na etapa de análise (a chamada ao Gemini).
+
+    - No máximo 'max_em_voo' análises rodam ao mesmo tempo (semáforo).
+    - As que passarem disso esperam na fila, até 'max_fila'.
+    - Acima disso, a mensagem é recusada na hora: ela vai para o buffer
+      durável ('pending_messages') e é processada quando houver capacidade.
+
+    Todo o estado daqui só é lido e alterado no event loop; as threads só
+    falam com o banco. É isso que torna "decidir + reservar" atômico.
+    """
+
+    def __init__(self, max_em_voo: int, max_fila: int):
+        self.max_em_voo = max_em_voo
+        self.max_fila = max_fila
+        self._semaforo = asyncio.Semaphore(max_em_voo)
+        self._chats_estacionados: set[int] = set() # Chats com mensagens no buffer
+        # Para não tirar do conjunto um chat que estacionou enquanto o buffer
+        # era lido numa thread: quantas gravações de cada chat estão em andamento
+        # e em que "geração" começou a última delas.
+        self._gravando: dict[int, int] = {}
+        self._ultimo_park: dict[int, int] = {}
+        self._geracao = 0
+
+        # Métricas
+        self.em_voo = 0
+        self.na_fila = 0
+        self.recusadas = 0
+        self.esperas = 0
+        self.espera_total = 0.0 # segundos
+        self.espera_maxima = 0.0
+
+    # --- Decisão de admissão ---
+
+    def sobrecarregado(self) -> bool:
+        """'True' se a fila de análises já está cheia."""
+        return self.na_fila >= self.max_fila
+
+    def tem_capacidade(self) -> bool:
+        """'True' se há vaga livre agora (ninguém esperando e semáforo livre)."""
+        return self.na_fila == 0 and self.em_voo < self.max_em_voo
+
+    def deve_estacionar(self, chat_id: int) -> bool:
+        """
+        Estaciona se o bot está sobrecarregado OU se este chat já tem
+        mensagens no buffer (para não passar na frente delas e manter a ordem).
+        """
+        return chat_id in self._chats_estacionados or self.sobrecarregado()
+
+    def admitir(self, chat_id: int) -> "Reserva | None":
+        """
+        Decide e reserva de uma vez (sem 'await' no meio): ou a mensagem deve
+        estacionar ('None'), ou ela já ocupa um lugar na fila a partir de agora.
+        Sem isso, várias mensagens passariam pelo 'deve_estacionar' antes de
+        qualquer uma chegar na 'vaga', e o limite 'max_fila' não valeria.
+        """
+        if self.deve_estacionar(chat_id):
+            return None
+        return self.reservar()
+
+    def reservar(self) -> "Reserva":
+        """Reserva um lugar na fila sem passar pela decisão (buffer e checkpoints)."""
+        self.na_fila += 1
+        return Reserva(self)
+
+    async def estacionar(self, chat_id: int, texto: str) -> bool:
+        """
+        Guarda a mensagem no buffer durável.
+        Retorna 'True' se é a primeira mensagem estacionada deste chat.
+        """
+        # O chat entra no conjunto ANTES da gravação: as próximas mensagens
+        # dele já estacionam atrás desta.
+        primeira = chat_id not in self._chats_estacionados
+        self._chats_estacionados.add(chat_id)
+        self._geracao += 1
+        self._ultimo_park[chat_id] = self._geracao
+        self._gravando[chat_id] = self._gravando.get(chat_id, 0) + 1
+        try:
+            await asyncio.to_thread(self._gravar_estacionada, chat_id, texto)
+        finally:
+            self._gravando[chat_id] -= 1
+            if not self._gravando[chat_id]:
+                del self._gravando[chat_id]
+        self.recusadas += 1
+        return primeira
+
+    def _gravar_estacionada(self, chat_id: int, texto: str):
+        db = SessionLocal()
+        try:
+            crud.park_message(db, chat_id=chat_id, text=texto)
+        finally:
+            db.close()
+
+    def _estacionou_desde(self, chat_id: int, geracao: int, gravando_antes: set[int]) -> bool:
+        """'True' se o chat tinha (ou começou) uma gravação no buffer desde a 'geracao'."""
+        return (chat_id in gravando_antes or chat_id in self._gravando
+                or self._ultimo_park.get(chat_id, 0) > geracao)
+
+    # --- A vaga na etapa de análise ---
+
+    @asynccontextmanager
+    async def vaga(self, reserva: "Reserva | None" = None):
+        """
+        Espera (e mede a espera) por uma vaga para analisar.
+        Com uma 'reserva' da admissão, o lugar na fila já estava ocupado.
+        """
+        inicio = time.monotonic()
+        if reserva is None:
+            reserva = self.reservar()
+        try:
+            await self._semaforo.acquire()
+        finally:
+            reserva.liberar()
+        espera = time.monotonic() - inicio
+        self.esperas += 1
+        self.espera_total += espera
+        self.espera_maxima = max(self.espera_maxima, espera)
+
+        self.em_voo += 1
+        try:
+            yield
+        finally:
+            self.em_voo -= 1
+            self._semaforo.release()
+
+    # --- O buffer durável ---
+
+    def _ler_chats_estacionados(self) -> set[int]:
+        db = SessionLocal()
+        try:
+            return crud.get_parked_chat_ids(db)
+        finally:
+            db.close()
+
+    def carregar(self):
+        """Na inicialização: descobre quais chats ficaram com mensagens no buffer."""
+        self._chats_estacionados = self._ler_chats_estacionados()
+        if self._chats_estacionados:
+            print(f"[Admissão] {len(self._chats_estacionados)} chat(s) com mensagens estacionadas.")
+
+    async def _recarregar(self):
+        """
+        Relê do banco quais chats têm mensagens estacionadas (no event loop).
+        Mantém os que estacionaram enquanto a consulta rodava.
+        """
+        geracao, gravando_antes = self._geracao, set(self._gravando)
+        do_banco = await asyncio.to_thread(self._ler_chats_estacionados)
+        self._chats_estacionados = do_banco | {
+            c for c in self._chats_estacionados if self._estacionou_desde(c, geracao, gravando_antes)
+        }
+        self._ultimo_park = {c: g for c, g in self._ultimo_park.items() if c in self._chats_estacionados}
+
+    def _retirar_proxima(self) -> tuple[int, str, bool] | None:
+        """
+        Retira a mensagem mais antiga do buffer (roda numa thread).
+        Retorna '(chat_id, texto, ainda_tem)', onde 'ainda_tem' diz se o chat
+        continua com mensagens estacionadas. Não mexe em '_chats_estacionados':
+        isso só pode acontecer depois que a mensagem for agendada.
+        """
+        db = SessionLocal()
+        try:
+            proxima = crud.pop_oldest_parked_message(db)
+            if proxima is None:
+                return None
+            chat_id, texto = proxima
+            return chat_id, texto, crud.has_parked_messages(db, chat_id)
+        finally:
+            db.close()
+
+    def contar_estacionadas(self) -> int:
+        """Quantas mensagens estão no buffer durável agora (roda numa thread)."""
+        db = SessionLocal()
+        try:
+            return crud.count_parked_messages(db)
+        finally:
+            db.close()
+
+    async def esvaziar_buffer(self, entregar):
+        """
+        Loop de fundo: a cada intervalo, retira do buffer tantas mensagens
+        quantas vagas livres houver e as entrega para 'entregar(chat_id, texto)'
+        (que só agenda o processamento, sem bloquear).
+        """
+        while True:
+            await asyncio.sleep(settings.BACKLOG_DRAIN_INTERVAL_SECONDS)
+            if not self._chats_estacionados or not self.tem_capacidade():
+                continue
+            try:
+                for _ in range(self.max_em_voo - self.em_voo):
+                    geracao, gravando_antes = self._geracao, set(self._gravando)
+                    proxima = await asyncio.to_thread(self._retirar_proxima)
+                    if proxima is None:
+                        # O buffer parece vazio: confere no banco em vez de esvaziar
+                        # o conjunto às cegas (uma mensagem pode ter acabado de chegar).
+                        await self._recarregar()
+                        break
+                    chat_id, texto, ainda_tem = proxima
+                    print(f"[Admissão] Processando mensagem estacionada do usuário {chat_id}.")
+                    entregar(chat_id, texto)
+                    # Só agora o chat sai do conjunto: até aqui, uma mensagem nova
+                    # dele ainda precisava estacionar para não passar na frente.
+                    # E só se nada dele estacionou enquanto líamos o buffer.
+                    if not ainda_tem and not self._estacionou_desde(chat_id, geracao, gravando_antes):
+                        self._chats_estacionados.discard(chat_id)
+                        self._ultimo_park.pop(chat_id, None)
+            except Exception as e:
+                print(f"[Admissão] Erro ao esvaziar o buffer: {e}")
+
+    # --- Métricas ---
+
+    def metricas(self) -> dict:
+        """Uma foto das métricas de admissão."""
+        return {
+            "analises_em_voo": self.em_voo,
+            "analises_na_fila": self.na_fila,
+            "chats_estacionados": len(self._chats_estacionados),
+            "mensagens_recusadas": self.recusadas,
+            "espera_media_s": round(self.espera_total / self.esperas, 3) if self.esperas else 0.0,
+            "espera_maxima_s": round(self.espera_maxima, 3),
+        }
+
+class Reserva:
+    """
+    Um lugar na fila de análises, ocupado desde a admissão.
+    É liberado ao conseguir a vaga ou, se a análise nem acontecer, no fim do processamento.
+    """
+
+    def __init__(self, controle: ControleDeAdmissao):
+        self._controle = controle
+        self.ativa = True
+
+    def liberar(self):
+        if self.ativa:
+            self.ativa = False
+            self._controle.na_fila -= 1
+
+# A instância única usada pelo bot
+controle = ControleDeAdmissao(settings.MAX_INFLIGHT_ANALYSES, settings.MAX_QUEUED_ANALYSES)
@@ -1,13 +1,135 @@
 # legacy_app/bot/app.py
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+import asyncio
+import signal
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters
 
 # Importa nossas configurações centrais e os handlers
 from legacy_app.core.config import settings
+from legacy_app.core import diagnostics
 from . import handlers
+from . import idempotency
+from . import admission
+from . import reminders
+from . import lifecycle
 
 # Importa a função de inicialização do banco
 from legacy_app.db.database import init_db
 
+# Importa os serviços de fundo (transcrição e estatísticas)
+from legacy_app.services import transcription
+from legacy_app.services import stats
+
+async def post_init(application: Application):
+    """Executado pelo PTB antes de começar a buscar updates."""
+    # Diagnóstico (opcional): começa antes de tudo para medir até a inicialização
+    if settings.DIAGNOSTICS_ENABLED:
+        diagnostics.monitor.iniciar()
+
+    idempotency.filtro.carregar()
+    admission.controle.carregar()
+
+    # Primeiro, retoma o que o último desligamento deixou em checkpoint
+    # (antes de qualquer mensagem nova, que ainda nem começamos a buscar)
+    trabalhos = await asyncio.to_thread(lifecycle.gerenciador.carregar_checkpoints)
+    if trabalhos:
+        print(f"Retomando {len(trabalhos)} trabalho(s) do último desligamento...")
+    for trabalho in trabalhos:
+        handlers.retomar_trabalho(application.bot, trabalho)
+
+    # Desligamento gracioso: nós cuidamos do SIGINT/SIGTERM (ver 'desligar')
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sinal, lambda: _agendar_desligamento(application))
+        except NotImplementedError:
+            pass # Windows: sem sinais no event loop, o Ctrl+C para o bot na hora
+
+    # Tarefa de fundo que processa as mensagens estacionadas quando sobra capacidade
+    application.bot_data["tarefa_buffer"] = asyncio.create_task(
+        admission.controle.esvaziar_buffer(
+            lambda chat_id, texto: handlers.iniciar_processamento(application.bot, chat_id, texto, do_buffer=True)
+        )
+    )
+
+    # Tarefa de fundo que grava a marca d'água dos updates em lote
+    application.bot_data["tarefa_marca_dagua"] = asyncio.create_task(
+        idempotency.filtro.persistir_periodico(settings.DEDUP_PERSIST_INTERVAL_SECONDS)
+    )
+
+    # Tarefa de fundo que grava os contadores do funil em lote
+    application.bot_data["tarefa_stats"] = asyncio.create_task(
+        stats.acumulador.flush_periodico(settings.STATS_FLUSH_INTERVAL_SECONDS)
+    )
+
+    # Tarefa de fundo que cutuca usuários parados (lembretes)
+    if settings.REMINDERS_ENABLED:
+        agendador = reminders.AgendadorDeLembretes(application.bot)
+        application.bot_data["tarefa_lembretes"] = asyncio.create_task(agendador.rodar())
+
+def _agendar_desligamento(application: Application):
+    if "tarefa_desligamento" not in application.bot_data:
+        application.bot_data["tarefa_desligamento"] = asyncio.create_task(desligar(application))
+
+async def desligar(application: Application):
+    """
+    Desligamento sem perder mensagens (deploys, restarts):
+      1. Para de buscar updates novos no Telegram.
+      2. Para as tarefas de fundo que criariam trabalho novo.
+      3. Entrega as rajadas que o agrupador estava segurando.
+      4. Espera as análises (e transcrições de áudio) em andamento até o
+         prazo; o resto vira checkpoint.
+      5. Só então deixa o PTB terminar de desligar. Os handlers do PTB só
+         fazem verificações rápidas, então o 'stop' dele não fica preso.
+    """
+    print("Sinal de desligamento recebido. Terminando o que está em andamento...")
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+
+    for nome in ("tarefa_buffer", "tarefa_lembretes"):
+        tarefa = application.bot_data.pop(nome, None)
+        if tarefa:
+            tarefa.cancel()
+
+    handlers.agrupador.entregar_todos(application.bot)
+    # A partir daqui 'aceitando' é falso: o que o PTB ainda processar da fila
+    # dele pula o agrupador e vira checkpoint na hora (ver 'receber_texto').
+    await lifecycle.gerenciador.drenar(settings.SHUTDOWN_DRAIN_SECONDS)
+
+    application.stop_running()
+
+async def post_stop(application: Application):
+    """Executado pelo PTB quando o bot para de buscar updates."""
+    for nome in ("tarefa_buffer", "tarefa_lembretes"):
+        tarefa = application.bot_data.pop(nome, None)
+        if tarefa:
+            tarefa.cancel()
+
+    diagnostics.monitor.parar()
+
+    tarefa_stats = application.bot_data.pop("tarefa_stats", None)
+    if tarefa_stats:
+        tarefa_stats.cancel()
+    # Último flush: não perdemos os contadores acumulados desde o anterior
+    try:
+        await asyncio.to_thread(stats.acumulador.flush)
+    except Exception as e:
+        print(f"[Estatísticas] Erro no flush final: {e}")
+
+    tarefa_marca = application.bot_data.pop("tarefa_marca_dagua", None)
+    if tarefa_marca:
+        tarefa_marca.cancel()
+    # Última gravação da marca d'água (os trabalhos já terminaram ou viraram checkpoint)
+    try:
+        await idempotency.filtro.gravar()
+    except Exception as e:
+        print(f"[Idempotência] Erro na gravação final da marca d'água: {e}")
+
+async def post_shutdown(application: Application):
+    """Executado pelo PTB depois que o bot para: libera os workers de transcrição."""
+    transcription.encerrar_pool()
+
 def main():
     """
     Função principal para construir e iniciar o bot de Telegram
@@ -26,20 +148,42 @@ def main():
     print("Bot iniciando...")
     
     # 2. Cria o aplicativo do bot usando o Token
-    application = Application.builder().token(settings.TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(settings.TELEGRAM_TOKEN)
+        .concurrent_updates(settings.CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # 3. Registra os "handlers" (comandos e lógica)
+    # Grupo -1 roda antes de todos: descarta updates reentregues pelo Telegram
+    application.add_handler(TypeHandler(Update, idempotency.descartar_duplicatas), group=-1)
+    # Último grupo: marca como concluídos os updates que não viraram um trabalho
+    application.add_handler(TypeHandler(Update, idempotency.concluir_update), group=100)
+
     # Diz ao bot: "Quando você receber o comando /start, 
     # chame a função 'start_command' do handlers.py"
     application.add_handler(CommandHandler("start", handlers.start_command))
+    application.add_handler(CommandHandler("metricas", handlers.metricas_command))
+    application.add_handler(CommandHandler("estatisticas", handlers.estatisticas_command))
+    if settings.DIAGNOSTICS_ENABLED:
+        application.add_handler(CommandHandler("perfil", handlers.perfil_command))
     
     # "Quando receber qualquer mensagem de texto que NÃO seja um comando,
     # chame a função 'handle_text' do handlers.py"
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_text))
 
+    # "Quando receber uma mensagem de voz ou um arquivo de áudio,
+    # chame a função 'handle_voice' (que transcreve e cai no mesmo loop)"
+    application.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, handlers.handle_voice))
+
     # 4. Inicia o bot
     print("Bot iniciado e 'ouvindo' por mensagens (Polling)...")
-    application.run_polling()
+    # 'stop_signals=None': os sinais são tratados pelo nosso 'desligar' (ver 'post_init')
+    application.run_polling(stop_signals=None)
 
 # Nota: Não há 'if __name__ == "__main__"' aqui.
 # Este arquivo será chamado pelo 'run.py'.
\ No newline at end of file
@@ -0,0 +1,68 @@
+# legacy_app/bot/coalescing.py
+import asyncio
+import time
+
+from telegram import Bot
+
+class AgrupadorDeMensagens:
+    """
+    Junta as "rajadas" de mensagens de um mesmo chat num único turno.
+
+    Muita gente conta a história em 3 ou 4 mensagens seguidas. Em vez de
+    chamar o Gemini para cada uma, cada chat tem um buffer: a cada mensagem
+    nova o relógio recomeça, e só depois de 'silencio' segundos sem mensagens
+    (ou 'espera_maxima' segundos desde a primeira) os textos são juntados
+    e entregues de uma vez para 'entregar(bot, chat_id, texto, update_ids=...)'.
+    """
+
+    def __init__(self, silencio: float, espera_maxima: float, entregar):
+        self.silencio = silencio
+        self.espera_maxima = espera_maxima
+        self.entregar = entregar # Não bloqueia: só agenda o processamento
+        self._buffers: dict[int, list[str]] = {}
+        self._update_ids: dict[int, list[int]] = {} # Os updates de cada rajada
+        self._inicio: dict[int, float] = {} # Quando chegou a 1ª mensagem da rajada
+        self._timers: dict[int, asyncio.Task] = {}
+
+    def adicionar(self, bot: Bot, chat_id: int, texto: str, update_id: int | None = None):
+        """Coloca a mensagem no buffer do chat e (re)inicia o relógio. Não bloqueia."""
+        agora = time.monotonic()
+        self._buffers.setdefault(chat_id, []).append(texto)
+        if update_id is not None:
+            self._update_ids.setdefault(chat_id, []).append(update_id)
+        self._inicio.setdefault(chat_id, agora)
+
+        timer = self._timers.get(chat_id)
+        if timer:
+            timer.cancel()
+
+        limite = self._inicio[chat_id] + self.espera_maxima - agora
+        espera = max(0.0, min(self.silencio, limite))
+        self._timers[chat_id] = asyncio.create_task(self._esperar_e_entregar(bot, chat_id, espera))
+
+    async def _esperar_e_entregar(self, bot: Bot, chat_id: int, espera: float):
+        await asyncio.sleep(espera)
+        # Daqui em diante não pode mais ser cancelado por uma mensagem nova:
+        # a próxima mensagem abre uma rajada nova.
+        textos, update_ids = self.retirar(chat_id)
+        if not textos:
+            return
+        if len(textos) > 1:
+            print(f"[Usuário {chat_id}] {len(textos)} mensagens agrupadas num único turno.")
+        self.entregar(bot, chat_id, "\n".join(textos), update_ids=update_ids)
+
+    def entregar_todos(self, bot: Bot):
+        """Entrega já todas as rajadas em espera (usado no desligamento)."""
+        for chat_id in list(self._buffers):
+            timer = self._timers.get(chat_id)
+            if timer:
+                timer.cancel()
+            textos, update_ids = self.retirar(chat_id)
+            if textos:
+                self.entregar(bot, chat_id, "\n".join(textos), update_ids=update_ids)
+
+    def retirar(self, chat_id: int) -> tuple[list[str], list[int]]:
+        """Esvazia o buffer do chat e devolve os textos (em ordem de chegada) e seus updates."""
+        self._timers.pop(chat_id, None)
+        self._inicio.pop(chat_id, None)
+        return self._buffers.pop(chat_id, []), self._update_ids.pop(chat_id, [])
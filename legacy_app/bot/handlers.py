@@ -1,16 +1,32 @@
 # legacy_app/bot/handlers.py
-from telegram import Update
+import asyncio
+import os
+import tempfile
+import weakref
+
+import httpx
+from telegram import Bot, InputFile, Update
 from telegram.ext import ContextTypes
 from sqlalchemy.orm import Session
 
+from legacy_app.core.config import settings
+from legacy_app.core import diagnostics
+
 # Importa nossas ferramentas de banco de dados (CRUD) e conexão
 from legacy_app.db import crud
-from legacy_app.db.database import SessionLocal
+from legacy_app.db.database import SessionLocal, SessionLeitura, metricas_pool
 
 # Importa o "cérebro" especialista e o "Contrato" de Intenção
-from legacy_app.services import analysis
+from legacy_app.services import transcription
+from legacy_app.services import stats
 from legacy_app.services.analysis import UserIntent # Importa o Enum
 
+# Importa o controle de carga (contrapressão) da etapa de análise
+from . import admission
+from . import coalescing
+from . import idempotency
+from . import lifecycle
+
 # --- Configuração ---
 MAX_REFINEMENT_ATTEMPTS = 3 # A "Rede de Segurança": número de perguntas complementares
 
@@ -20,6 +36,33 @@ def get_db() -> Session:
     """Helper para obter uma sessão de DB limpa."""
     return SessionLocal()
 
+def buscar_pergunta(order_id: int):
+    """
+    Busca uma pergunta na réplica de leitura (ou no primário, se não houver réplica).
+    As perguntas são fixas, então um pequeno atraso de replicação não importa.
+    """
+    db_leitura = SessionLeitura()
+    try:
+        return crud.get_question_by_order(db_leitura, order_id=order_id)
+    finally:
+        db_leitura.close()
+
+def eh_admin(update: Update) -> bool:
+    """Verifica se a mensagem veio de um chat de administrador."""
+    return update.message.chat_id in settings.ADMIN_CHAT_IDS
+
+# Uma trava por chat. O 'WeakValueDictionary' esquece a trava
+# sozinho quando ninguém mais está usando ou esperando por ela.
+_travas_por_chat: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def trava_do_chat(chat_id: int) -> asyncio.Lock:
+    """Retorna a trava do chat (criando uma, se preciso)."""
+    trava = _travas_por_chat.get(chat_id)
+    if trava is None:
+        trava = asyncio.Lock()
+        _travas_por_chat[chat_id] = trava
+    return trava
+
 # --- Handler: /start ---
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -43,7 +86,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # 2. Verifica se o usuário está 'IDLE' (ocioso)
         if user.user_state == 'IDLE':
-            question = crud.get_question_by_order(db, order_id=user.current_question_id)
+            question = buscar_pergunta(order_id=user.current_question_id)
             if question:
                 await update.message.reply_text(
                     f"Vamos começar.\n\nPergunta #{question.order}: {question.question_text}"
@@ -52,6 +95,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 crud.set_user_state_conversing(db, user, question_id=question.order)
             else:
                 await update.message.reply_text("Você já respondeu todas as perguntas por enquanto!")
+                crud.clear_user_reminder(db, user)
         else:
             # Se o usuário der /start no meio de uma conversa, não o interrompa.
             await update.message.reply_text(
@@ -70,55 +114,333 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Lida com todas as mensagens de texto do usuário.
-    Este é o "Gerente" que implementa o "Loop de Refinamento".
+    O trabalho de verdade fica no 'processar_mensagem'.
+    """
+    receber_texto(context.bot, update.message.chat_id, update.message.text, update_id=update.update_id)
+
+def receber_texto(bot: Bot, chat_id: int, raw_text: str, update_id: int | None = None):
+    """
+    Entrega o texto ao agrupador de rajadas (ou direto ao "Gerente",
+    se o agrupamento estiver desligado). Retorna sem esperar a análise.
+    """
+    if update_id is not None:
+        # O update só é concluído (para a marca d'água) quando o trabalho terminar
+        idempotency.filtro.adotar(update_id)
+    # Desligando, o PTB ainda termina a fila dele e os handlers em andamento
+    # (um áudio sendo transcrito, por exemplo). Essas mensagens não podem
+    # esperar o agrupador: o timer morreria com o loop. Vão direto para o
+    # 'iniciar_processamento', que as guarda em checkpoint.
+    if settings.COALESCE_QUIET_SECONDS > 0 and lifecycle.gerenciador.aceitando:
+        agrupador.adicionar(bot, chat_id, raw_text, update_id=update_id)
+    else:
+        iniciar_processamento(bot, chat_id, raw_text, update_ids=[update_id] if update_id is not None else [])
+
+def iniciar_processamento(bot: Bot, chat_id: int, raw_text: str, do_buffer: bool = False, update_ids: list[int] | None = None):
+    """
+    Coloca a mensagem no "Gerente" numa tarefa acompanhada pelo 'lifecycle',
+    para que um desligamento possa esperá-la ou guardá-la em checkpoint.
+    """
+    trabalho = lifecycle.Trabalho(chat_id=chat_id, texto=raw_text, update_ids=list(update_ids or []))
+    lifecycle.gerenciador.iniciar(trabalho, processar_mensagem(bot, trabalho, do_buffer=do_buffer))
+
+def retomar_trabalho(bot: Bot, trabalho: lifecycle.Trabalho):
+    """Retoma um trabalho interrompido no último desligamento (vindo de um checkpoint)."""
+    if trabalho.arquivo_voz:
+        # O áudio ainda não tinha sido transcrito: começa por aí
+        lifecycle.gerenciador.iniciar(trabalho, processar_audio(bot, trabalho))
+    else:
+        lifecycle.gerenciador.iniciar(trabalho, processar_mensagem(bot, trabalho, do_buffer=True))
+
+# --- Handler: Mensagens de Voz / Áudio ---
+
+async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Lida com mensagens de voz e arquivos de áudio.
+    Só faz as verificações de guarda: o download e a transcrição (que podem
+    levar minutos) rodam num trabalho acompanhado pelo 'lifecycle', para que
+    o desligamento tenha prazo e guarde o áudio em checkpoint.
     """
     chat_id = update.message.chat_id
-    raw_text = update.message.text
+    midia = update.message.voice or update.message.audio
+
+    # --- Verificações de Guarda ---
+    # Antes de gastar o pool de transcrição: o áudio só serve se o usuário
+    # existe e está no meio de uma pergunta.
+    db = get_db()
+    try:
+        user = crud.get_user_by_chat_id(db, chat_id=chat_id)
+        user_state = user.user_state if user else None
+    finally:
+        db.close()
+
+    if not user:
+        await update.message.reply_text("Por favor, use /start para começar.")
+        return
+    if user_state == 'IDLE':
+        await update.message.reply_text(
+            "Desculpe, não estou esperando uma resposta agora. "
+            "Você pode usar /start para vermos a próxima pergunta."
+        )
+        return
+
+    await update.message.reply_text("Recebi seu áudio! Deixe-me ouvir com atenção...")
+
+    # O update só é concluído (para a marca d'água) quando o trabalho terminar
+    idempotency.filtro.adotar(update.update_id)
+    trabalho = lifecycle.Trabalho(
+        chat_id=chat_id, texto="", fase="transcrevendo",
+        arquivo_voz=midia.file_id, update_ids=[update.update_id]
+    )
+    lifecycle.gerenciador.iniciar(trabalho, processar_audio(context.bot, trabalho))
+
+async def processar_audio(bot: Bot, trabalho: lifecycle.Trabalho):
+    """
+    Baixa e transcreve o áudio de 'trabalho.arquivo_voz' e entrega o texto
+    ao mesmo "Loop de Refinamento" das mensagens de texto.
+    """
+    chat_id = trabalho.chat_id
+    trabalho.fase = "transcrevendo"
+    try:
+        with tempfile.TemporaryDirectory(prefix="legacy_audio_") as pasta:
+            caminho_audio = os.path.join(pasta, "entrada")
+            arquivo = await bot.get_file(trabalho.arquivo_voz)
+            await baixar_arquivo(arquivo.file_path, caminho_audio)
+            texto_transcrito = await transcription.transcrever_audio(caminho_audio, pasta)
+    except Exception as e:
+        print(f"ERRO na transcrição do áudio [Usuário {chat_id}]: {e}")
+        await bot.send_message(chat_id=chat_id, text="Desculpe, não consegui ouvir seu áudio. Pode tentar de novo ou escrever?")
+        return
+
+    if not texto_transcrito:
+        await bot.send_message(chat_id=chat_id, text="Hum, não consegui entender nada nesse áudio. Pode repetir?")
+        return
+
+    print(f"[Usuário {chat_id}] Áudio transcrito ({len(texto_transcrito)} caracteres).")
+    # Sob a trava: o desligamento pode estar gravando o checkpoint deste trabalho agora
+    with trabalho.trava:
+        trabalho.texto, trabalho.arquivo_voz = texto_transcrito, None
+        em_checkpoint = trabalho.checkpoint_id is not None
+        trabalho.fase = "aguardando" if em_checkpoint else "entregue"
+    if em_checkpoint:
+        # Já tem checkpoint (retomado, ou o desligamento chegou antes):
+        # segue no mesmo trabalho, para não existirem dois checkpoints do mesmo áudio
+        await processar_mensagem(bot, trabalho, do_buffer=True)
+        return
+    # Um áudio novo entra no agrupador como qualquer mensagem; o update
+    # passa para o trabalho que o agrupador criar.
+    update_ids, trabalho.update_ids = trabalho.update_ids, []
+    receber_texto(bot, chat_id, texto_transcrito, update_id=update_ids[0] if update_ids else None)
+
+async def baixar_arquivo(url: str, destino: str):
+    """
+    Baixa um arquivo do Telegram em blocos, direto para o disco (sem carregar tudo na memória).
+    CUIDADO: a URL do Telegram contém o token do bot. Os erros do httpx trazem
+    a URL na mensagem, então os trocamos por um erro sem ela (e sem a "causa").
+    """
+    try:
+        async with httpx.AsyncClient(timeout=60) as client:
+            async with client.stream("GET", url) as resposta:
+                resposta.raise_for_status()
+                with open(destino, "wb") as f:
+                    async for bloco in resposta.aiter_bytes():
+                        f.write(bloco)
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(f"Falha no download do áudio (HTTP {e.response.status_code})") from None
+    except httpx.HTTPError as e:
+        raise RuntimeError(f"Falha no download do áudio ({type(e).__name__})") from None
+
+# O agrupador de rajadas: várias mensagens seguidas -> um único turno
+agrupador = coalescing.AgrupadorDeMensagens(
+    silencio=settings.COALESCE_QUIET_SECONDS,
+    espera_maxima=settings.COALESCE_MAX_WAIT_SECONDS,
+    entregar=iniciar_processamento
+)
+
+# --- Handler: /metricas (administração) ---
+
+async def metricas_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mostra as métricas de carga do bot (só para administradores)."""
+    if not eh_admin(update):
+        return
+    metricas = {**admission.controle.metricas(), **metricas_pool()}
+    try:
+        metricas["mensagens_estacionadas"] = await asyncio.to_thread(admission.controle.contar_estacionadas)
+    except Exception as e:
+        print(f"[Métricas] Erro ao contar as mensagens estacionadas: {e}")
+    if settings.DIAGNOSTICS_ENABLED:
+        metricas.update(diagnostics.monitor.metricas())
+    linhas = [f"{nome}: {valor}" for nome, valor in metricas.items()]
+    await update.message.reply_text("📊 Métricas\n\n" + "\n".join(linhas))
+
+# --- Handler: /estatisticas (administração) ---
+
+async def estatisticas_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mostra o funil de perguntas (só para administradores). Lê só a tabela agregada."""
+    if not eh_admin(update):
+        return
+    db_leitura = SessionLeitura()
+    try:
+        contadores = stats.ler(db_leitura)
+    finally:
+        db_leitura.close()
+    await update.message.reply_text("📈 Funil de perguntas\n\n" + stats.formatar(contadores))
+
+# --- Handler: /perfil (administração, só com DIAGNOSTICS_ENABLED) ---
+
+async def perfil_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Liga o profiler por amostragem por N segundos (/perfil 30) e devolve
+    um arquivo de pilhas "colapsadas" (para flamegraph.pl ou speedscope).
+    """
+    if not eh_admin(update):
+        return
+    try:
+        segundos = int(context.args[0]) if context.args else 10
+    except ValueError:
+        await update.message.reply_text("Uso: /perfil <segundos>")
+        return
+    segundos = max(1, min(segundos, settings.PROFILER_MAX_SECONDS))
+
+    if diagnostics.amostrador.rodando:
+        await update.message.reply_text("O profiler já está rodando. Espere ele terminar.")
+        return
+
+    diagnostics.amostrador.iniciar()
+    await update.message.reply_text(f"🔬 Profiler ligado por {segundos}s...")
+    try:
+        await asyncio.sleep(segundos)
+    finally:
+        pilhas = diagnostics.amostrador.parar()
+
+    await update.message.reply_document(
+        document=InputFile(pilhas.encode("utf-8"), filename=f"perfil_{segundos}s.folded"),
+        caption="Pilhas colapsadas. Abra em https://www.speedscope.app ou use flamegraph.pl."
+    )
+
+# --- O "GERENTE" (Loop de Refinamento) ---
+
+async def processar_mensagem(bot: Bot, trabalho: lifecycle.Trabalho, do_buffer: bool = False):
+    """
+    Ponto de entrada do "Loop de Refinamento" para qualquer origem
+    (texto, áudio transcrito, mensagem estacionada no buffer ou checkpoint).
+    'trabalho.texto' é o texto bruto do usuário.
+    """
+    chat_id, raw_text = trabalho.chat_id, trabalho.texto
+
+    # --- Controle de Admissão ---
+    # Decidir e reservar o lugar na fila acontece de uma vez (ver 'admitir').
+    # Se o bot estiver sobrecarregado, a mensagem vai para o buffer durável
+    # e é processada depois, pelo 'esvaziar_buffer'.
+    reserva = admission.controle.reservar() if do_buffer else admission.controle.admitir(chat_id)
+    if reserva is None:
+        # Enquanto grava, o desligamento não pode transformar isto em checkpoint
+        # (a mensagem seria processada duas vezes: do checkpoint e do buffer)
+        trabalho.fase = "estacionando"
+        primeira = await admission.controle.estacionar(chat_id, raw_text)
+        print(f"[Usuário {chat_id}] Bot sobrecarregado. Mensagem estacionada.")
+        if primeira:
+            await bot.send_message(
+                chat_id=chat_id,
+                text="Estou um pouquinho ocupado agora, mas já anotei sua mensagem. Volto a falar com você em instantes!"
+            )
+        return
+
+    try:
+        # Uma mensagem por vez para cada chat: com updates concorrentes,
+        # duas mensagens do mesmo usuário não podem mexer no rascunho ao mesmo tempo.
+        async with trava_do_chat(chat_id):
+            await _executar_refinamento(bot, trabalho, reserva)
+    finally:
+        reserva.liberar() # Se a análise nem aconteceu, o lugar na fila volta aqui
+
+async def _executar_refinamento(bot: Bot, trabalho: lifecycle.Trabalho, reserva: admission.Reserva | None = None):
+    """
+    Este é o "Gerente" que implementa o "Loop de Refinamento".
+    Não depende do 'Update', então pode ser chamado por qualquer origem.
+    """
+    chat_id, raw_text = trabalho.chat_id, trabalho.texto
+
+    async def responder(texto: str):
+        await bot.send_message(chat_id=chat_id, text=texto)
+
     db = get_db()
     user_updated = False # Flag para saber se precisamos comitar no final
 
     try:
         user = crud.get_user_by_chat_id(db, chat_id=chat_id)
+        if user:
+            historia_anterior = user.context_cache
+            question_id_lido, user_state_lido = user.current_question_id, user.user_state
+        # A conexão volta para o pool ANTES de qualquer espera (Telegram, vaga,
+        # Gemini). Presa durante a análise, ela esgota o pool justamente na
+        # sobrecarga. A sessão é reaberta (transação nova) na hora de aplicar.
+        db.close()
         
         # --- Verificações de Guarda ---
         if not user:
-            await update.message.reply_text("Por favor, use /start para começar.")
-            db.close()
+            await responder("Por favor, use /start para começar.")
             return
         
-        if user.user_state == 'IDLE':
-            await update.message.reply_text(
+        if user_state_lido == 'IDLE':
+            await responder(
                 "Desculpe, não estou esperando uma resposta agora. "
                 "Você pode usar /start para vermos a próxima pergunta."
             )
-            db.close()
             return
         
         # --- O LOOP DE REFINAMENTO (NV 3.1) ---
         # Se chegamos aqui, o user_state é 'CONVERSANDO_Q...'
         
-        # 1. Pega o "rascunho" anterior do banco
-        historia_anterior = user.context_cache 
+        # 1. O "rascunho" anterior ('historia_anterior') já foi lido acima
         
-        await update.message.reply_text("Hum, deixe-me pensar sobre isso...")
+        if (trabalho.analise is not None
+                and trabalho.rascunho == historia_anterior
+                and trabalho.question_id == question_id_lido
+                and trabalho.user_state == user_state_lido):
+            # Retomado de um checkpoint: o Gemini já tinha respondido sobre
+            # este mesmo rascunho, na mesma pergunta, antes do restart.
+            # (Só o rascunho não basta: um rascunho vazio é igual em toda pergunta nova.)
+            print(f"[Usuário {chat_id}] Retomando análise do checkpoint.")
+            analise = trabalho.analise
+        else:
+            trabalho.rascunho = historia_anterior
+            trabalho.question_id = question_id_lido
+            trabalho.user_state = user_state_lido
+            trabalho.analise = None
+            await responder("Hum, deixe-me pensar sobre isso...")
 
-        # 2. Chama o "Cérebro Nv3.1" (agora mais inteligente)
-        analise = analysis.analisar_e_refinar(
-            historia_anterior=historia_anterior,
-            novo_texto=raw_text
-        )
+            # 2. Chama o "Cérebro Nv3.1" (agora mais inteligente)
+            # Espera uma vaga na etapa de análise e roda o Gemini fora do event loop.
+            async with admission.controle.vaga(reserva):
+                trabalho.fase = "analisando"
+                analise = await asyncio.to_thread(trabalho.analisar)
+
+        # Daqui para frente mexemos no banco e respondemos: não pode parar no meio
+        trabalho.fase = "aplicando"
+
+        # Relê o usuário na sessão reaberta. A trava do chat impede outro turno,
+        # mas conferimos que a conversa continua no mesmo ponto da leitura.
+        user = crud.get_user_by_chat_id(db, chat_id=chat_id)
+        if (not user or user.current_question_id != question_id_lido
+                or user.user_state != user_state_lido or user.context_cache != historia_anterior):
+            print(f"[Usuário {chat_id}] A conversa mudou durante a análise. Resultado descartado.")
+            return
+
+        question_id = user.current_question_id
+        stats.incrementar(stats.por_pergunta(stats.TURNOS, question_id))
 
         # 3. O GERENTE TOMA A DECISÃO
         
         # --- Cenário 1: "FUGA INTELIGENTE" (O usuário quer parar) ---
         if analise.user_intent == UserIntent.STOPPING:
             print(f"[Usuário {chat_id}] Detectada INTENÇÃO DE FUGA.")
-            await update.message.reply_text("Entendido. Sem problemas, vamos seguir em frente.")
+            stats.incrementar(stats.por_pergunta(stats.FUGAS, question_id))
+            await responder("Entendido. Sem problemas, vamos seguir em frente.")
 
             # Salva o que quer que esteja no "rascunho" (cache),
             # DESDE QUE o rascunho não esteja vazio.
             if historia_anterior:
-                crud.create_story_chunk(db, user=user, final_story=historia_anterior)
+                crud.create_story_chunk(db, user=user, final_story=historia_anterior, raw_transcription=user.raw_cache)
                 print(f"[Usuário {chat_id}] História (do cache) APROVADA via fuga.")
             
             # Avança para a próxima pergunta
@@ -127,23 +449,28 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_updated = True # O estado do usuário mudou
 
             # Envia a próxima pergunta
-            next_question = crud.get_question_by_order(db, order_id=user.current_question_id)
+            next_question = buscar_pergunta(order_id=user.current_question_id)
             if next_question:
-                await update.message.reply_text(
+                await responder(
                     f"Quando estiver pronto, aqui está a próxima pergunta:\n\n"
                     f"#{next_question.order}: {next_question.question_text}"
                 )
                 crud.set_user_state_conversing(db, user, question_id=next_question.order)
             else:
-                await update.message.reply_text("Você respondeu todas as perguntas! Parabéns!")
+                await responder("Você respondeu todas as perguntas! Parabéns!")
+                crud.clear_user_reminder(db, user)
 
         # --- Cenário 2: "FUGA DA REDE DE SEGURANÇA" (Muitas tentativas) ---
         elif user.refinement_attempts >= MAX_REFINEMENT_ATTEMPTS:
             print(f"[Usuário {chat_id}] Atingido MAX_REFINEMENT_ATTEMPTS.")
-            await update.message.reply_text("Entendido, acho que temos o suficiente sobre isso. Vamos seguir.")
+            stats.incrementar(stats.por_pergunta(stats.REDE_SEGURANCA, question_id))
+            await responder("Entendido, acho que temos o suficiente sobre isso. Vamos seguir.")
             
             # Forçamos a aprovação da última história editada
-            crud.create_story_chunk(db, user=user, final_story=analise.historia_editada)
+            crud.create_story_chunk(
+                db, user=user, final_story=analise.historia_editada,
+                raw_transcription=crud.join_raw_text(user.raw_cache, raw_text)
+            )
             
             # Avança para a próxima pergunta
             next_q_id = user.current_question_id + 1
@@ -151,39 +478,45 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_updated = True # O estado do usuário mudou
             
             # ... (código para enviar a próxima pergunta) ...
-            next_question = crud.get_question_by_order(db, order_id=user.current_question_id)
+            next_question = buscar_pergunta(order_id=user.current_question_id)
             if next_question:
-                await update.message.reply_text(
+                await responder(
                     f"Quando estiver pronto, aqui está a próxima pergunta:\n\n"
                     f"#{next_question.order}: {next_question.question_text}"
                 )
                 crud.set_user_state_conversing(db, user, question_id=next_question.order)
             else:
-                await update.message.reply_text("Você respondeu todas as perguntas! Parabéns!")
+                await responder("Você respondeu todas as perguntas! Parabéns!")
+                crud.clear_user_reminder(db, user)
 
         # --- Cenário 3: "APROVADO" (História está boa) ---
         elif analise.esta_completo:
             print(f"[Usuário {chat_id}] História APROVADA para Q{user.current_question_id}.")
+            stats.incrementar(stats.por_pergunta(stats.APROVADAS, question_id))
             
-            await update.message.reply_text("Entendido! Que ótima história. Anotei aqui:")
-            await update.message.reply_text(analise.historia_editada)
+            await responder("Entendido! Que ótima história. Anotei aqui:")
+            await responder(analise.historia_editada)
             
-            crud.create_story_chunk(db, user=user, final_story=analise.historia_editada)
+            crud.create_story_chunk(
+                db, user=user, final_story=analise.historia_editada,
+                raw_transcription=crud.join_raw_text(user.raw_cache, raw_text)
+            )
             
             next_q_id = user.current_question_id + 1
             user = crud.set_user_state_idle(db, user, next_question_id=next_q_id)
             user_updated = True # O estado do usuário mudou
 
             # ... (código para enviar a próxima pergunta) ...
-            next_question = crud.get_question_by_order(db, order_id=user.current_question_id)
+            next_question = buscar_pergunta(order_id=user.current_question_id)
             if next_question:
-                await update.message.reply_text(
+                await responder(
                     f"Quando estiver pronto, aqui está a próxima pergunta:\n\n"
                     f"#{next_question.order}: {next_question.question_text}"
                 )
                 crud.set_user_state_conversing(db, user, question_id=next_question.order)
             else:
-                await update.message.reply_text("Você respondeu todas as perguntas! Parabéns!")
+                await responder("Você respondeu todas as perguntas! Parabéns!")
+                crud.clear_user_reminder(db, user)
 
         # --- Cenário 4: "REPROVADO" (Continuar o loop) ---
         else: # (analise.esta_completo == false E user_intent != STOPPING)
@@ -193,19 +526,23 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user.refinement_attempts += 1
             user_updated = True # O estado do usuário mudou
             
-            # Atualiza o rascunho (cache)
-            crud.update_user_context_cache(db, user, new_cache_content=analise.historia_editada)
+            # Atualiza o rascunho (cache) e guarda o texto bruto desta rodada
+            crud.update_user_context_cache(db, user, new_cache_content=analise.historia_editada, raw_text=raw_text)
             
             # Envia a pergunta complementar (o estado NÃO muda)
-            await update.message.reply_text(analise.pergunta_complementar)
+            await responder(analise.pergunta_complementar)
             
     except Exception as e:
         print(f"ERRO CRÍTICO no handle_text: {e}")
-        await update.message.reply_text("Ops, algo deu muito errado ao processar sua história. Vamos tentar de novo.")
+        await responder("Ops, algo deu muito errado ao processar sua história. Vamos tentar de novo.")
         # Tenta redefinir o estado do usuário para 'IDLE' para destravar
-        if 'user' in locals():
-            crud.set_user_state_idle(db, user, next_question_id=user.current_question_id)
-            user_updated = True
+        # (relido: o 'user' pode ser da leitura, de antes de fecharmos a sessão)
+        if 'user' in locals() and user:
+            db.rollback()
+            user = crud.get_user_by_chat_id(db, chat_id=chat_id)
+            if user:
+                crud.set_user_state_idle(db, user, next_question_id=user.current_question_id)
+                user_updated = True
     
     finally:
         # Commit centralizado
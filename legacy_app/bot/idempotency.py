@@ -0,0 +1,157 @@
+# legacy_app/bot/idempotency.py
+import asyncio
+import time
+from collections import deque
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from legacy_app.core.config import settings
+from legacy_app.db import crud
+from legacy_app.db.database import SessionLocal
+
+class FiltroDeDuplicatas:
+    """
+    Detecta updates do Telegram reentregues (restart do bot, retry de webhook).
+
+    Duas camadas, ambas O(1):
+      1. Um "anel" na memória com os últimos 'update_id' aceitos
+         (um 'deque' de tamanho fixo + um 'set' para a consulta).
+      2. A marca d'água persistida no banco: o maior 'update_id' que este
+         worker já aceitou. Ela cobre o caso do restart, quando o anel está vazio.
+
+    A marca d'água vai para o banco em lote (ver 'persistir_periodico'), e só
+    até o último update que já foi CONCLUÍDO: se o bot cair no meio de uma
+    mensagem, o Telegram a reentrega no próximo início e ela não é descartada.
+
+    A marca d'água tem validade ('idade_maxima' segundos sem updates novos):
+    depois de uma semana parado, o Telegram sorteia o próximo 'update_id', e
+    uma marca antiga descartaria em silêncio todas as mensagens novas.
+    """
+
+    def __init__(self, worker_id: str, tamanho_janela: int, idade_maxima: float):
+        self.worker_id = worker_id
+        self.idade_maxima = idade_maxima
+        self._anel = deque(maxlen=tamanho_janela)
+        self._vistos = set()
+        self.marca_dagua = 0 # Carregada do banco no 'carregar'
+        self._marca_em = 0.0 # Quando chegou o último update (time.time())
+        self._marca_gravada = 0 # O que já está no banco
+        self._reiniciar = False # A sequência do Telegram recomeçou: gravar sem 'GREATEST'
+        # Updates aceitos mas ainda não concluídos (e os que viraram um 'Trabalho')
+        self._pendentes: set[int] = set()
+        self._adotados: set[int] = set()
+
+    def carregar(self):
+        """Lê a marca d'água persistida (chamado uma vez, na inicialização do bot)."""
+        db = SessionLocal()
+        try:
+            marca = crud.get_update_watermark(db, self.worker_id)
+            if marca:
+                self.marca_dagua = marca.last_update_id
+                self._marca_em = marca.updated_at.timestamp() if marca.updated_at else 0.0
+        finally:
+            db.close()
+        self._marca_gravada = self.marca_dagua
+        print(f"[Idempotência] Worker '{self.worker_id}' retoma a partir do update {self.marca_dagua}.")
+
+    def ja_visto(self, update_id: int) -> bool:
+        """'True' se este update já foi aceito antes (nesta execução ou numa anterior)."""
+        if update_id in self._vistos:
+            return True
+        if update_id > self.marca_dagua:
+            return False
+        if time.time() - self._marca_em > self.idade_maxima:
+            # Abaixo de uma marca vencida: não é reentrega, o Telegram recomeçou a sequência
+            print(f"[Idempotência] Marca d'água {self.marca_dagua} vencida e update {update_id} abaixo dela. "
+                  "O Telegram reiniciou a sequência: marca d'água zerada.")
+            self.marca_dagua = 0
+            self._marca_gravada = 0
+            self._reiniciar = True
+            return False
+        return True
+
+    def registrar(self, update_id: int):
+        """Marca o update como aceito (o mais antigo sai do anel quando ele enche)."""
+        if len(self._anel) == self._anel.maxlen:
+            self._vistos.discard(self._anel[0])
+        self._anel.append(update_id)
+        self._vistos.add(update_id)
+        self._pendentes.add(update_id)
+        self.marca_dagua = max(self.marca_dagua, update_id)
+        self._marca_em = time.time()
+
+    def adotar(self, update_id: int):
+        """Um 'Trabalho' assumiu o update: ele é concluído quando o trabalho terminar."""
+        self._adotados.add(update_id)
+
+    def concluir(self, update_ids):
+        """O update foi processado (ou guardado no banco): a marca d'água pode passar dele."""
+        for update_id in update_ids:
+            self._pendentes.discard(update_id)
+            self._adotados.discard(update_id)
+
+    def concluir_se_livre(self, update_id: int):
+        """Conclui o update, a menos que um 'Trabalho' o tenha adotado."""
+        if update_id not in self._adotados:
+            self.concluir([update_id])
+
+    def marca_segura(self) -> int:
+        """Maior 'update_id' tal que ele e todos os anteriores já foram concluídos."""
+        if self._pendentes:
+            return min(self._pendentes) - 1
+        return self.marca_dagua
+
+    def persistir(self, marca: int, reiniciar: bool = False):
+        """Grava a marca d'água no banco."""
+        db = SessionLocal()
+        try:
+            crud.save_update_watermark(db, self.worker_id, marca, reset=reiniciar)
+        finally:
+            db.close()
+
+    async def gravar(self):
+        """Grava a marca segura, se ela andou desde a última gravação (ou se a sequência recomeçou)."""
+        marca = self.marca_segura() # Calculada no event loop: os 'sets' só mudam aqui
+        reiniciar = self._reiniciar
+        if marca <= self._marca_gravada and not reiniciar:
+            return
+        await asyncio.to_thread(self.persistir, marca, reiniciar)
+        self._marca_gravada = marca
+        if reiniciar:
+            self._reiniciar = False
+
+    async def persistir_periodico(self, intervalo: float):
+        """Loop de fundo que grava a marca d'água a cada 'intervalo' segundos."""
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await self.gravar()
+            except Exception as e:
+                # Sem a marca d'água ainda temos o anel; tentamos de novo no próximo ciclo.
+                print(f"[Idempotência] Falha ao gravar a marca d'água: {e}")
+
+# A instância única usada pelo bot
+filtro = FiltroDeDuplicatas(
+    settings.WORKER_ID, settings.DEDUP_WINDOW_SIZE, settings.DEDUP_WATERMARK_MAX_AGE_HOURS * 3600
+)
+
+async def descartar_duplicatas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handler do grupo -1: roda ANTES de qualquer outro handler.
+    Se o update for uma reentrega, interrompe o processamento dele aqui mesmo.
+    """
+    if filtro.ja_visto(update.update_id):
+        print(f"[Idempotência] Update {update.update_id} reentregue. Descartado.")
+        raise ApplicationHandlerStop
+
+    # Registramos ANTES de processar: uma segunda cópia que chegue
+    # enquanto a primeira ainda está no Gemini também é descartada.
+    filtro.registrar(update.update_id)
+
+async def concluir_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handler do último grupo: roda DEPOIS dos outros handlers.
+    Se nenhum 'Trabalho' assumiu o update (comandos, áudio recusado...), ele já terminou.
+    """
+    filtro.concluir_se_livre(update.update_id)
@@ -0,0 +1,182 @@
+# legacy_app/bot/lifecycle.py
+import asyncio
+import threading
+from dataclasses import dataclass, field
+
+from legacy_app.db import crud
+from legacy_app.db.database import SessionLocal
+from legacy_app.services import analysis
+from legacy_app.services.analysis import AnaliseDaHistoria
+
+from . import idempotency
+
+# -----------------------------------------------------------------
+# 1. O TRABALHO (uma mensagem a caminho do "Gerente")
+# -----------------------------------------------------------------
+@dataclass
+class Trabalho:
+    """
+    Uma mensagem (ou rajada) sendo processada para um chat.
+    Guarda o suficiente para ser retomada depois de um restart.
+    """
+    chat_id: int
+    texto: str
+    # ['transcrevendo' (áudio) ->] 'aguardando' (trava/vaga) -> 'analisando' (Gemini)
+    # -> 'aplicando' (banco + respostas). Ou 'estacionando' (indo para o buffer),
+    # ou 'entregue' (áudio transcrito que seguiu num trabalho novo).
+    fase: str = "aguardando"
+    # 'file_id' de um áudio ainda não transcrito ('texto' fica vazio até lá)
+    arquivo_voz: str | None = None
+    rascunho: str | None = None # O 'context_cache' que foi para a análise
+    # A pergunta e o estado do usuário quando o rascunho foi lido: a análise
+    # só vale para este mesmo ponto da conversa
+    question_id: int | None = None
+    user_state: str | None = None
+    analise: AnaliseDaHistoria | None = None
+    checkpoint_id: int | None = None
+    # Os updates do Telegram que geraram este trabalho (para a marca d'água)
+    update_ids: list[int] = field(default_factory=list)
+    # Protege 'analise'/'checkpoint_id': a análise termina numa thread
+    trava: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def analisar(self) -> AnaliseDaHistoria:
+        """
+        Chama o Gemini (roda numa thread). Se o trabalho já virou checkpoint
+        enquanto esperávamos, a resposta vai direto para o checkpoint:
+        assim, no restart, não pagamos a mesma chamada duas vezes.
+        """
+        resultado = analysis.analisar_e_refinar(historia_anterior=self.rascunho, novo_texto=self.texto)
+        with self.trava:
+            self.analise = resultado
+            if self.checkpoint_id is not None:
+                db = SessionLocal()
+                try:
+                    crud.set_checkpoint_analysis(db, self.checkpoint_id, resultado.model_dump_json())
+                finally:
+                    db.close()
+        return resultado
+
+    def salvar_checkpoint(self):
+        """Grava (ou atualiza) o checkpoint deste trabalho."""
+        with self.trava:
+            if self.fase == "entregue":
+                return # O texto já está em outro trabalho: gravar aqui o duplicaria
+            db = SessionLocal()
+            try:
+                self.checkpoint_id = crud.save_checkpoint(
+                    db,
+                    checkpoint_id=self.checkpoint_id,
+                    chat_id=self.chat_id,
+                    text=self.texto,
+                    draft=self.rascunho,
+                    question_id=self.question_id,
+                    user_state=self.user_state,
+                    voice_file_id=self.arquivo_voz,
+                    analysis=self.analise.model_dump_json() if self.analise else None,
+                )
+            finally:
+                db.close()
+
+    def apagar_checkpoint(self):
+        """O trabalho terminou: o checkpoint (se houver) não é mais necessário."""
+        if self.checkpoint_id is None:
+            return
+        db = SessionLocal()
+        try:
+            crud.delete_checkpoint(db, self.checkpoint_id)
+        finally:
+            db.close()
+
+# -----------------------------------------------------------------
+# 2. O GERENCIADOR (sabe o que está em andamento)
+# -----------------------------------------------------------------
+class GerenciadorDeTrabalhos:
+    """
+    Acompanha todos os trabalhos em andamento para poder desligar o bot
+    sem perder mensagens: espera o que dá para esperar e guarda o resto.
+    """
+
+    def __init__(self):
+        self.aceitando = True
+        self._em_andamento: dict[asyncio.Task, Trabalho] = {}
+
+    # Fases que não podem ser interrompidas (são curtas): o desligamento as espera
+    #  - 'aplicando': já mexe no banco e responde ao usuário
+    #  - 'estacionando': a mensagem está sendo gravada no buffer durável. Um
+    #    checkpoint agora faria ela ser processada DUAS vezes no próximo início.
+    #  - 'entregue': o texto já seguiu em outro trabalho (que tem seu próprio checkpoint)
+    FASES_SEM_VOLTA = ("aplicando", "estacionando", "entregue")
+
+    def iniciar(self, trabalho: Trabalho, coro):
+        """
+        Roda 'coro' (o processamento do 'trabalho') numa tarefa acompanhada.
+        Se o bot já está desligando, o trabalho vira checkpoint na hora.
+        """
+        if not self.aceitando:
+            coro.close()
+            trabalho.salvar_checkpoint()
+            idempotency.filtro.concluir(trabalho.update_ids) # Já está no banco
+            print(f"[Desligamento] Mensagem do usuário {trabalho.chat_id} guardada para o próximo início.")
+            return
+        tarefa = asyncio.create_task(self._rodar(trabalho, coro))
+        self._em_andamento[tarefa] = trabalho
+        tarefa.add_done_callback(self._em_andamento.pop)
+
+    async def _rodar(self, trabalho: Trabalho, coro):
+        try:
+            await coro
+            # Terminou de verdade (não foi cancelado): um checkpoint antigo pode sumir
+            await asyncio.to_thread(trabalho.apagar_checkpoint)
+        finally:
+            # Processado, estacionado ou em checkpoint: em todos os casos a
+            # mensagem não se perde mais, e a marca d'água pode passar dela.
+            idempotency.filtro.concluir(trabalho.update_ids)
+
+    async def drenar(self, prazo: float):
+        """
+        Espera os trabalhos em andamento por até 'prazo' segundos.
+        Os que não terminarem viram checkpoint e são cancelados, exceto
+        os que estão em 'FASES_SEM_VOLTA' (curtos, e não podem parar pela metade).
+        """
+        self.aceitando = False
+        tarefas = set(self._em_andamento)
+        if not tarefas:
+            return
+        print(f"[Desligamento] Esperando {len(tarefas)} trabalho(s) em andamento (até {prazo:.0f}s)...")
+        _, pendentes = await asyncio.wait(tarefas, timeout=prazo)
+
+        for tarefa in pendentes:
+            trabalho = self._em_andamento.get(tarefa)
+            if trabalho is None or trabalho.fase in self.FASES_SEM_VOLTA:
+                continue
+            await asyncio.to_thread(trabalho.salvar_checkpoint)
+            # Pode ter avançado enquanto gravávamos: só cancelamos se ainda dá para parar
+            if trabalho.fase not in self.FASES_SEM_VOLTA:
+                tarefa.cancel()
+                print(f"[Desligamento] Trabalho do usuário {trabalho.chat_id} guardado em checkpoint.")
+
+        await asyncio.gather(*pendentes, return_exceptions=True)
+
+    def carregar_checkpoints(self) -> list[Trabalho]:
+        """Lê os trabalhos interrompidos no último desligamento."""
+        db = SessionLocal()
+        try:
+            checkpoints = crud.get_checkpoints(db)
+        finally:
+            db.close()
+        return [
+            Trabalho(
+                chat_id=c.chat_id,
+                texto=c.text,
+                rascunho=c.draft,
+                question_id=c.question_id,
+                user_state=c.user_state,
+                arquivo_voz=c.voice_file_id,
+                analise=AnaliseDaHistoria.model_validate_json(c.analysis) if c.analysis else None,
+                checkpoint_id=c.id,
+            )
+            for c in checkpoints
+        ]
+
+# A instância única usada pelo bot
+gerenciador = GerenciadorDeTrabalhos()
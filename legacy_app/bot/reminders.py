@@ -0,0 +1,195 @@
+# legacy_app/bot/reminders.py
+import asyncio
+import time
+from datetime import timedelta
+
+from telegram import Bot
+from telegram.error import Forbidden, RetryAfter
+
+from legacy_app.core.config import settings
+from legacy_app.db import crud
+from legacy_app.db.database import SessionLocal
+
+class LimitadorDeTaxa:
+    """
+    "Balde de fichas": no máximo 'taxa' envios por segundo, com uma pequena
+    rajada permitida. Mantém o bot abaixo do limite do Telegram.
+    """
+
+    def __init__(self, taxa: float, rajada: int = 1):
+        self.taxa = taxa
+        self.capacidade = max(1, rajada)
+        self._fichas = float(self.capacidade)
+        self._ultimo = time.monotonic()
+
+    async def aguardar(self):
+        """Espera até haver uma ficha disponível e a consome."""
+        while True:
+            agora = time.monotonic()
+            self._fichas = min(self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa)
+            self._ultimo = agora
+            if self._fichas >= 1:
+                self._fichas -= 1
+                return
+            await asyncio.sleep((1 - self._fichas) / self.taxa)
+
+class RodaDoTempo:
+    """
+    Uma "roda do tempo" (timing wheel) com 'posicoes' casas de 'tick' segundos.
+
+    O banco é a fonte da verdade (a coluna indexada 'next_reminder_at').
+    A roda só guarda "quando acordar" para o próximo trecho de tempo
+    (uma volta): a cada volta, os próximos vencimentos são lidos do índice
+    e marcados nas casas. Nos ticks de casas vazias, o agendador não faz nada,
+    então não há consulta ao banco a cada segundo.
+    """
+
+    def __init__(self, posicoes: int, tick: float):
+        self.posicoes = posicoes
+        self.tick = tick
+        self._casas = [False] * posicoes
+        self.cursor = 0
+        self._inicio_da_casa_atual = time.time()
+
+    @property
+    def horizonte(self) -> float:
+        """Quantos segundos à frente a roda enxerga (uma volta)."""
+        return self.posicoes * self.tick
+
+    def marcar(self, quando: float):
+        """Marca a casa correspondente ao instante 'quando' (timestamp Unix)."""
+        atraso = quando - self._inicio_da_casa_atual
+        # A casa atual já foi processada: o mínimo é a próxima casa
+        passos = min(max(1, int(atraso // self.tick) + 1), self.posicoes - 1)
+        self._casas[(self.cursor + passos) % self.posicoes] = True
+
+    def segundos_ate_a_proxima_casa(self) -> float:
+        """Quanto falta para a próxima casa (sem acumular atraso entre os ticks)."""
+        return max(0.0, self._inicio_da_casa_atual + self.tick - time.time())
+
+    def avancar(self) -> tuple[bool, bool]:
+        """
+        Anda uma casa. Retorna (casa_marcada, deu_uma_volta).
+        """
+        self.cursor = (self.cursor + 1) % self.posicoes
+        self._inicio_da_casa_atual += self.tick
+        marcada = self._casas[self.cursor]
+        self._casas[self.cursor] = False
+        return marcada, self.cursor == 0
+
+class AgendadorDeLembretes:
+    """
+    Cutuca usuários parados no meio de uma história ou ociosos há dias.
+    Escala para centenas de milhares de usuários porque nunca mantém um timer
+    por usuário: só uma roda do tempo e consultas em lote no índice.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.roda = RodaDoTempo(settings.REMINDER_WHEEL_SLOTS, settings.REMINDER_TICK_SECONDS)
+        self.limitador = LimitadorDeTaxa(settings.REMINDER_RATE_PER_SECOND, rajada=int(settings.REMINDER_RATE_PER_SECOND))
+        self.enviados = 0
+
+    # --- Banco (roda em thread, fora do event loop) ---
+
+    def _carregar_roda(self):
+        """Lê do índice os vencimentos da próxima volta e os marca na roda."""
+        db = SessionLocal()
+        try:
+            ate = crud.utcnow() + timedelta(seconds=self.roda.horizonte)
+            horarios = crud.get_upcoming_reminder_times(db, until=ate, limit=settings.REMINDER_BATCH_SIZE)
+        finally:
+            db.close()
+        for horario in horarios:
+            self.roda.marcar(horario.timestamp())
+        # Se a lista veio cheia, pode haver mais: olhamos de novo na próxima volta.
+
+    def _buscar_vencidos(self) -> list[dict]:
+        db = SessionLocal()
+        try:
+            return crud.claim_due_reminders(
+                db,
+                now=crud.utcnow(),
+                limit=settings.REMINDER_BATCH_SIZE,
+                max_reminders=settings.REMINDER_MAX_PER_USER,
+                stalled_hours=settings.REMINDER_STALLED_HOURS,
+                idle_hours=settings.REMINDER_IDLE_HOURS,
+            )
+        finally:
+            db.close()
+
+    def _cancelar(self, chat_id: int):
+        db = SessionLocal()
+        try:
+            crud.clear_reminder_by_chat_id(db, chat_id)
+        finally:
+            db.close()
+
+    # --- Envio ---
+
+    @staticmethod
+    def montar_mensagem(usuario: dict) -> str:
+        nome = usuario["first_name"] or ""
+        if usuario["user_state"].startswith("CONVERSANDO"):
+            return (
+                f"Olá, {nome}! Ficamos no meio da sua história sobre a pergunta "
+                f"#{usuario['current_question_id']}. Quando quiser, é só continuar de onde paramos."
+            )
+        return f"Olá, {nome}! Que tal contarmos mais uma história? Use /start para ver a próxima pergunta."
+
+    async def _enviar(self, usuario: dict):
+        """Envia um lembrete respeitando o limite de taxa."""
+        chat_id = usuario["chat_id"]
+        await self.limitador.aguardar()
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=self.montar_mensagem(usuario))
+            self.enviados += 1
+        except RetryAfter as e:
+            # O Telegram pediu calma: esperamos o que ele mandou e tentamos uma vez mais
+            await asyncio.sleep(e.retry_after)
+            await self.bot.send_message(chat_id=chat_id, text=self.montar_mensagem(usuario))
+            self.enviados += 1
+        except Forbidden:
+            # O usuário bloqueou o bot: não adianta insistir
+            print(f"[Lembretes] Usuário {chat_id} bloqueou o bot. Lembretes cancelados.")
+            await asyncio.to_thread(self._cancelar, chat_id)
+
+    async def processar_vencidos(self):
+        """Busca e envia, em lotes, todos os lembretes vencidos até agora."""
+        while True:
+            lote = await asyncio.to_thread(self._buscar_vencidos)
+            if not lote:
+                return
+            print(f"[Lembretes] Enviando {len(lote)} lembrete(s)...")
+            for usuario in lote:
+                try:
+                    await self._enviar(usuario)
+                except Exception as e:
+                    print(f"[Lembretes] Erro ao lembrar o usuário {usuario['chat_id']}: {e}")
+            if len(lote) < settings.REMINDER_BATCH_SIZE:
+                return
+
+    # --- O loop principal ---
+
+    async def rodar(self):
+        """
+        Loop de fundo. Na inicialização (inclusive depois de um restart),
+        envia primeiro tudo o que venceu enquanto o bot estava fora do ar.
+        """
+        print("[Lembretes] Agendador iniciado.")
+        await self.processar_vencidos()
+        await asyncio.to_thread(self._carregar_roda)
+
+        while True:
+            await asyncio.sleep(self.roda.segundos_ate_a_proxima_casa())
+            marcada, deu_uma_volta = self.roda.avancar()
+            try:
+                if marcada:
+                    await self.processar_vencidos()
+                if deu_uma_volta:
+                    # Uma volta completa: pega os lembretes agendados nesse meio tempo
+                    # (por esta ou por outras instâncias) e os vencidos que sobraram.
+                    await self.processar_vencidos()
+                    await asyncio.to_thread(self._carregar_roda)
+            except Exception as e:
+                print(f"[Lembretes] Erro no agendador: {e}")
@@ -13,13 +13,97 @@ class Settings(BaseSettings):
     
     # BANCO DE DADOS
     DATABASE_URL: str
+    # Réplica somente-leitura (opcional). Perguntas, exportações e
+    # estatísticas leem daqui; o primário fica só com as escritas da conversa.
+    DATABASE_REPLICA_URL: str | None = None
+
+    # POOL DE CONEXÕES (vale para o primário e para a réplica)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    # Segundos até uma conexão ser reciclada (-1 = nunca)
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    # Quanto tempo esperar por uma conexão livre antes de dar erro
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    # 'pre_ping' testa a conexão (1 ida e volta ao banco) a cada checkout.
+    # Com 'DB_POOL_RECYCLE_SECONDS' bem ajustado, dá para desligar.
+    DB_POOL_PRE_PING: bool = True
     
     # BOT
     TELEGRAM_TOKEN: str
+    # Identifica esta instância do bot (cada worker tem sua marca d'água de updates)
+    WORKER_ID: str = "default"
+    # Quantos 'update_id' recentes ficam na memória para detectar reentregas
+    DEDUP_WINDOW_SIZE: int = 4096
+    # De quanto em quanto tempo a marca d'água vai para o banco (em lote, não por update)
+    DEDUP_PERSIST_INTERVAL_SECONDS: float = 5.0
+    # Depois de uma semana sem updates, o Telegram sorteia o próximo 'update_id'
+    # (pode ser MENOR que a marca d'água). Uma marca mais velha que isto é ignorada.
+    DEDUP_WATERMARK_MAX_AGE_HOURS: float = 72.0
+    # Quantos updates o PTB processa ao mesmo tempo (1 = um de cada vez)
+    CONCURRENT_UPDATES: int = 64
+    # Quem pode usar os comandos de administração (ex: /metricas)
+    ADMIN_CHAT_IDS: list[int] = []
+    # Mensagens seguidas do mesmo chat viram um único turno de refinamento:
+    # esperamos este "silêncio" (segundos) antes de analisar. 0 desliga.
+    COALESCE_QUIET_SECONDS: float = 4.0
+    # ...mas nunca seguramos uma rajada por mais do que isto
+    COALESCE_MAX_WAIT_SECONDS: float = 20.0
+
+    # DESLIGAMENTO: quanto tempo esperar as análises em andamento terminarem.
+    # O que não terminar a tempo vira um checkpoint e é retomado no próximo início.
+    SHUTDOWN_DRAIN_SECONDS: float = 20.0
+
+    # CONTROLE DE ADMISSÃO (contrapressão na etapa de análise)
+    # Máximo de análises rodando no Gemini ao mesmo tempo
+    MAX_INFLIGHT_ANALYSES: int = 8
+    # Máximo de análises esperando vaga. Acima disso, a mensagem é
+    # guardada no banco e o usuário recebe um "estou ocupado".
+    MAX_QUEUED_ANALYSES: int = 16
+    # De quanto em quanto tempo o bot tenta esvaziar as mensagens guardadas
+    BACKLOG_DRAIN_INTERVAL_SECONDS: float = 5.0
+
+    # ESTATÍSTICAS DO FUNIL
+    # De quanto em quanto tempo os contadores acumulados vão para o banco
+    STATS_FLUSH_INTERVAL_SECONDS: float = 30.0
+
+    # DIAGNÓSTICO (opcional): monitor de travamentos do event loop e /perfil
+    DIAGNOSTICS_ENABLED: bool = False
+    LOOP_LAG_INTERVAL_SECONDS: float = 0.1
+    # Travamentos do loop acima disto imprimem a pilha de quem travou
+    LOOP_BLOCK_THRESHOLD_SECONDS: float = 0.25
+    # Amostras por segundo do profiler do /perfil
+    PROFILER_SAMPLE_HZ: float = 100.0
+    PROFILER_MAX_SECONDS: int = 120
+
+    # LEMBRETES (usuários parados no meio de uma história ou ociosos)
+    REMINDERS_ENABLED: bool = True
+    # Primeiro lembrete depois de X horas sem resposta. Os seguintes dobram o intervalo.
+    REMINDER_STALLED_HOURS: float = 24.0  # Parado num 'CONVERSANDO_Q...'
+    REMINDER_IDLE_HOURS: float = 72.0     # Parado em 'IDLE'
+    REMINDER_MAX_PER_USER: int = 3        # Depois disso, paramos de insistir
+    # A "roda do tempo": N posições de X segundos (uma volta = N * X segundos)
+    REMINDER_TICK_SECONDS: float = 1.0
+    REMINDER_WHEEL_SLOTS: int = 60
+    # Quantos usuários vencidos buscar por consulta
+    REMINDER_BATCH_SIZE: int = 500
+    # Limite de envio (o Telegram aceita ~30 mensagens/s por bot)
+    REMINDER_RATE_PER_SECOND: float = 20.0
     
     # SERVIÇOS DE IA
     GOOGLE_API_KEY: str
 
+    # TRANSCRIÇÃO DE ÁUDIO (mensagens de voz)
+    # 'TRANSCRIBER' aceita um apelido conhecido ('faster_whisper', 'whisper')
+    # ou um caminho "modulo:Classe" para um transcritor próprio.
+    TRANSCRIBER: str = "faster_whisper"
+    WHISPER_MODEL: str = "small"
+    TRANSCRIPTION_LANGUAGE: str = "pt"
+    # Cada worker carrega o seu próprio modelo na memória!
+    TRANSCRIPTION_WORKERS: int = 2
+    # Áudios longos são fatiados em trechos deste tamanho (em segundos)
+    # e os trechos são transcritos em paralelo.
+    TRANSCRIPTION_CHUNK_SECONDS: int = 30
+
     class Config:
         # Informa ao Pydantic para carregar do arquivo .env
         env_file = ".env"
@@ -0,0 +1,154 @@
+# legacy_app/core/diagnostics.py
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from legacy_app.core.config import settings
+
+# -----------------------------------------------------------------
+# Diagnóstico do event loop (opcional: 'DIAGNOSTICS_ENABLED' no .env)
+#
+# O bot é assíncrono, mas várias chamadas dentro dos handlers são
+# síncronas (consultas do 'crud', 'print', etc). Quando uma delas demora,
+# o event loop inteiro para e TODOS os usuários esperam. Este módulo
+# mostra quanto o loop está atrasando e QUEM está travando.
+# -----------------------------------------------------------------
+
+class MonitorDoLoop:
+    """
+    Mede continuamente o atraso ("lag") do event loop e, quando ele fica
+    travado por mais de 'limite' segundos, imprime a pilha de quem está
+    segurando o loop naquele momento.
+
+    Duas peças:
+      - Uma tarefa no loop que "bate o ponto" a cada 'intervalo' segundos.
+      - Uma thread vigia: se o ponto não é batido a tempo, o loop está
+        travado, e ela tira uma foto da pilha da thread do loop.
+    """
+
+    def __init__(self, intervalo: float, limite: float):
+        self.intervalo = intervalo
+        self.limite = limite
+        self._ultimo_ponto = time.monotonic()
+        self._id_thread_do_loop: int | None = None
+        self._tarefa: asyncio.Task | None = None
+        self._vigia: threading.Thread | None = None
+        self._parar = threading.Event()
+
+        # Métricas
+        self.medicoes = 0
+        self.lag_total = 0.0
+        self.lag_maximo = 0.0
+        self.travamentos = 0
+
+    def iniciar(self):
+        """Começa a monitorar (chamar de dentro do event loop)."""
+        self._id_thread_do_loop = threading.get_ident()
+        self._ultimo_ponto = time.monotonic()
+        self._tarefa = asyncio.create_task(self._bater_ponto())
+        self._vigia = threading.Thread(target=self._vigiar, name="vigia-do-loop", daemon=True)
+        self._vigia.start()
+        print(f"[Diagnóstico] Monitor do loop ativo (avisa travamentos acima de {self.limite * 1000:.0f} ms).")
+
+    def parar(self):
+        self._parar.set()
+        if self._tarefa:
+            self._tarefa.cancel()
+
+    async def _bater_ponto(self):
+        while True:
+            antes = time.monotonic()
+            await asyncio.sleep(self.intervalo)
+            agora = time.monotonic()
+            # Se o sleep demorou mais que o pedido, a diferença é o lag do loop
+            lag = max(0.0, agora - antes - self.intervalo)
+            self.medicoes += 1
+            self.lag_total += lag
+            self.lag_maximo = max(self.lag_maximo, lag)
+            self._ultimo_ponto = agora
+
+    def _vigiar(self):
+        travamento_reportado = None
+        while not self._parar.wait(self.limite / 2):
+            ponto = self._ultimo_ponto
+            travado_ha = time.monotonic() - ponto - self.intervalo
+            if travado_ha < self.limite:
+                continue
+            if travamento_reportado == ponto:
+                continue # Mesmo travamento: já mostramos a pilha
+            travamento_reportado = ponto
+            self.travamentos += 1
+            frame = sys._current_frames().get(self._id_thread_do_loop)
+            pilha = "".join(traceback.format_stack(frame)) if frame else "(pilha indisponível)\n"
+            print(f"[Diagnóstico] Event loop TRAVADO há {travado_ha * 1000:.0f} ms. Quem está segurando:\n{pilha}")
+
+    def metricas(self) -> dict:
+        """Uma foto das métricas do loop."""
+        return {
+            "loop_lag_medio_ms": round(self.lag_total / self.medicoes * 1000, 2) if self.medicoes else 0.0,
+            "loop_lag_maximo_ms": round(self.lag_maximo * 1000, 2),
+            "loop_travamentos": self.travamentos,
+        }
+
+class AmostradorDePerfil:
+    """
+    Profiler por amostragem: uma thread tira uma foto das pilhas de todas
+    as threads 'hz' vezes por segundo. Não instrumenta nenhuma função, então
+    o custo é baixo mesmo em produção.
+
+    O resultado sai no formato "collapsed stacks" (uma pilha por linha,
+    'raiz;...;folha N'), que o flamegraph.pl e o speedscope leem direto.
+    """
+
+    def __init__(self, hz: float):
+        self.hz = hz
+        self._amostras = Counter()
+        self._thread: threading.Thread | None = None
+        self._parar = threading.Event()
+
+    @property
+    def rodando(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def iniciar(self):
+        if self.rodando:
+            raise RuntimeError("O profiler já está rodando.")
+        self._amostras = Counter()
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._amostrar, name="amostrador-de-perfil", daemon=True)
+        self._thread.start()
+
+    def parar(self) -> str:
+        """Para de amostrar e devolve as pilhas no formato 'collapsed'."""
+        self._parar.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        return "".join(f"{pilha} {total}\n" for pilha, total in self._amostras.most_common())
+
+    def _amostrar(self):
+        eu = threading.get_ident()
+        while not self._parar.wait(1 / self.hz):
+            nomes = {t.ident: t.name for t in threading.enumerate()}
+            for id_thread, frame in sys._current_frames().items():
+                if id_thread == eu or nomes.get(id_thread) == "vigia-do-loop":
+                    continue
+                self._amostras[self._colapsar(nomes.get(id_thread, str(id_thread)), frame)] += 1
+
+    @staticmethod
+    def _colapsar(nome_thread: str, frame) -> str:
+        pilha = []
+        while frame is not None:
+            codigo = frame.f_code
+            pilha.append(f"{codigo.co_name}@{codigo.co_filename}:{codigo.co_firstlineno}")
+            frame = frame.f_back
+        pilha.append(nome_thread)
+        # 'flamegraph.pl' separa os frames por ';' e a contagem pelo último espaço
+        return ";".join(p.replace(";", "_").replace(" ", "_") for p in reversed(pilha))
+
+# As instâncias únicas usadas pelo bot (só ligadas se 'DIAGNOSTICS_ENABLED')
+monitor = MonitorDoLoop(settings.LOOP_LAG_INTERVAL_SECONDS, settings.LOOP_BLOCK_THRESHOLD_SECONDS)
+amostrador = AmostradorDePerfil(settings.PROFILER_SAMPLE_HZ)
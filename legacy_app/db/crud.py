@@ -1,7 +1,14 @@
 # legacy_app/db/crud.py
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from . import models # Vamos mover/criar 'models.py' aqui em breve
+from legacy_app.core.config import settings
 from legacy_app.services.analysis import AnaliseDaHistoria # Importamos o "contrato" do cérebro
+from legacy_app.services import stats # Contadores incrementais do funil
 
 # --- Funções de Leitura (Read) ---
 
@@ -13,6 +20,72 @@ def get_question_by_order(db: Session, order_id: int) -> models.Question | None:
     """Busca uma pergunta pela sua ordem."""
     return db.query(models.Question).filter(models.Question.order == order_id).first()
 
+def get_story_chunk(db: Session, user_id: int, question_id: int) -> models.StoryChunk | None:
+    """Busca a história já salva de um usuário para uma pergunta."""
+    return db.query(models.StoryChunk).filter(
+        models.StoryChunk.user_id == user_id,
+        models.StoryChunk.question_id == question_id
+    ).first()
+
+def get_update_watermark(db: Session, worker_id: str) -> models.UpdateWatermark | None:
+    """Retorna a marca d'água deste worker ('update_id' e quando foi gravada), ou 'None' se nunca rodou."""
+    return db.get(models.UpdateWatermark, worker_id)
+
+def get_parked_chat_ids(db: Session) -> set[int]:
+    """Retorna os chats que têm mensagens estacionadas esperando processamento."""
+    return {row.chat_id for row in db.query(models.PendingMessage.chat_id).distinct()}
+
+def has_parked_messages(db: Session, chat_id: int) -> bool:
+    """Verifica se um chat ainda tem mensagens estacionadas."""
+    return db.query(models.PendingMessage.id).filter(models.PendingMessage.chat_id == chat_id).first() is not None
+
+def count_parked_messages(db: Session) -> int:
+    """Quantas mensagens estão estacionadas no total."""
+    return db.query(models.PendingMessage).count()
+
+def get_funnel_stats(db: Session) -> dict[str, int]:
+    """Lê todos os contadores agregados do funil (tabela pequena: não depende do nº de usuários)."""
+    return {row.key: row.value for row in db.query(models.FunnelStat).all()}
+
+def count_users_by_question(db: Session) -> dict[int, int]:
+    """VARREDURA COMPLETA de 'users': quantos usuários estão em cada pergunta."""
+    rows = db.query(models.User.current_question_id, func.count(models.User.id)).group_by(models.User.current_question_id)
+    return {question_id: total for question_id, total in rows}
+
+def count_story_chunks_by_question(db: Session) -> dict[int, int]:
+    """VARREDURA COMPLETA de 'story_chunks': quantas histórias salvas por pergunta."""
+    rows = db.query(models.StoryChunk.question_id, func.count(models.StoryChunk.id)).group_by(models.StoryChunk.question_id)
+    return {question_id: total for question_id, total in rows}
+
+def get_upcoming_reminder_times(db: Session, until: datetime, limit: int) -> list[datetime]:
+    """Os próximos horários de lembrete até 'until' (varredura no índice, sem tocar na tabela toda)."""
+    rows = (
+        db.query(models.User.next_reminder_at)
+        .filter(models.User.next_reminder_at <= until)
+        .order_by(models.User.next_reminder_at)
+        .limit(limit)
+    )
+    return [row.next_reminder_at for row in rows]
+
+def get_checkpoints(db: Session) -> list[models.ConversationCheckpoint]:
+    """Todos os trabalhos interrompidos no último desligamento, em ordem de chegada."""
+    return db.query(models.ConversationCheckpoint).order_by(models.ConversationCheckpoint.id).all()
+
+# --- Funções Helper ---
+
+def utcnow() -> datetime:
+    """'Agora', com fuso (UTC), para comparar com as colunas 'timezone=True'."""
+    return datetime.now(timezone.utc)
+
+def schedule_reminder(user: models.User, hours: float) -> None:
+    """Agenda o primeiro lembrete do usuário (não comita: quem chama comita)."""
+    user.next_reminder_at = utcnow() + timedelta(hours=hours)
+    user.reminders_sent = 0
+
+def join_raw_text(raw_cache: str | None, raw_text: str | None) -> str:
+    """Anexa um novo texto bruto ao acumulado, um por parágrafo."""
+    return "\n\n".join(t for t in (raw_cache, raw_text) if t)
+
 # --- Funções de Escrita (Create / Update) ---
 
 def create_user(db: Session, chat_id: int, first_name: str) -> models.User:
@@ -23,29 +96,40 @@ def create_user(db: Session, chat_id: int, first_name: str) -> models.User:
         first_name=first_name, 
         current_question_id=1,
         user_state='IDLE', # <- Adicionando o estado que planejamos
-        context_cache=None
+        context_cache=None,
+        raw_cache=None
     )
     db.add(new_user)
     db.commit()
     db.refresh(new_user) # Recarrega o 'new_user' com os dados do DB (como o ID)
+    stats.incrementar(stats.por_pergunta(stats.USUARIOS_NA, new_user.current_question_id))
     return new_user
 
-def create_story_chunk(db: Session, user: models.User, final_story: str) -> models.StoryChunk:
+def create_story_chunk(db: Session, user: models.User, final_story: str, raw_transcription: str | None = None) -> models.StoryChunk:
     """
     Salva a história final e APROVADA no banco.
+    'raw_transcription' é o texto bruto acumulado (digitado ou transcrito do áudio).
     """
     new_chunk = models.StoryChunk(
         user_id=user.id,
         question_id=user.current_question_id,
-        # Nós salvamos a história final em ambas as colunas por simplicidade.
-        # Poderíamos ter um "raw_text" que é a concatenação de todas as entradas,
-        # mas isso é mais limpo por agora.
-        raw_transcription=final_story, 
+        # Se não tivermos o bruto (ex: usuários antigos, sem 'raw_cache'),
+        # caímos de volta na história final.
+        raw_transcription=raw_transcription or final_story,
         edited_story=final_story
     )
     db.add(new_chunk)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Já existe uma história para esta pergunta (update reentregue).
+        # Não duplicamos: devolvemos a que já estava salva.
+        db.rollback()
+        print(f"[Usuário {user.chat_id}] StoryChunk duplicado para Q{user.current_question_id} ignorado.")
+        return get_story_chunk(db, user_id=user.id, question_id=user.current_question_id)
     db.refresh(new_chunk)
+    stats.incrementar(stats.por_pergunta(stats.HISTORIAS_SALVAS_Q, new_chunk.question_id))
+    stats.incrementar(stats.HISTORIAS_SALVAS)
     return new_chunk
 
 def set_user_state_idle(db: Session, user: models.User, next_question_id: int) -> models.User:
@@ -54,12 +138,19 @@ def set_user_state_idle(db: Session, user: models.User, next_question_id: int) -
     limpa o cache e avança para a próxima pergunta.
     Isso é chamado APÓS uma história ser salva com sucesso.
     """
+    previous_question_id = user.current_question_id
     user.user_state = 'IDLE'
     user.context_cache = None # Limpa o rascunho
+    user.raw_cache = None
     user.current_question_id = next_question_id
     user.refinement_attempts = 0
+    schedule_reminder(user, settings.REMINDER_IDLE_HOURS)
     db.commit()
     db.refresh(user)
+    if next_question_id != previous_question_id:
+        # O usuário "andou" no funil: sai de uma pergunta e entra na outra
+        stats.incrementar(stats.por_pergunta(stats.USUARIOS_NA, previous_question_id), -1)
+        stats.incrementar(stats.por_pergunta(stats.USUARIOS_NA, next_question_id))
     return user
 
 def set_user_state_conversing(db: Session, user: models.User, question_id: int) -> models.User:
@@ -69,16 +160,175 @@ def set_user_state_conversing(db: Session, user: models.User, question_id: int)
     """
     user.user_state = f'CONVERSANDO_Q{question_id}'
     user.context_cache = "" # Inicializa o rascunho como vazio
+    user.raw_cache = ""
     user.refinement_attempts = 0
+    schedule_reminder(user, settings.REMINDER_STALLED_HOURS)
     db.commit()
     db.refresh(user)
     return user
 
-def update_user_context_cache(db: Session, user: models.User, new_cache_content: str) -> models.User:
+def update_user_context_cache(db: Session, user: models.User, new_cache_content: str, raw_text: str | None = None) -> models.User:
     """
     Atualiza o "rascunho em construção" (cache) durante o loop de refinamento.
+    Se 'raw_text' for passado, ele é anexado ao texto bruto acumulado.
     """
     user.context_cache = new_cache_content
+    if raw_text:
+        user.raw_cache = join_raw_text(user.raw_cache, raw_text)
+    # O usuário respondeu: o relógio do lembrete recomeça
+    schedule_reminder(user, settings.REMINDER_STALLED_HOURS)
+    db.commit()
+    db.refresh(user)
+    return user
+
+def save_update_watermark(db: Session, worker_id: str, update_id: int, reset: bool = False) -> None:
+    """
+    Avança a marca d'água do worker (upsert). Nunca anda para trás:
+    'GREATEST' protege contra gravações concorrentes fora de ordem.
+    Com 'reset=True' grava o valor como está (o Telegram reiniciou a sequência).
+    """
+    stmt = insert(models.UpdateWatermark).values(worker_id=worker_id, last_update_id=update_id)
+    novo_valor = stmt.excluded.last_update_id if reset else func.greatest(
+        models.UpdateWatermark.last_update_id, stmt.excluded.last_update_id
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.UpdateWatermark.worker_id],
+        set_={"last_update_id": novo_valor, "updated_at": func.now()}
+    )
+    db.execute(stmt)
+    db.commit()
+
+def park_message(db: Session, chat_id: int, text: str) -> models.PendingMessage:
+    """Guarda uma mensagem para ser processada quando o bot tiver capacidade."""
+    pending = models.PendingMessage(chat_id=chat_id, text=text)
+    db.add(pending)
+    db.commit()
+    db.refresh(pending)
+    return pending
+
+def pop_oldest_parked_message(db: Session) -> tuple[int, str] | None:
+    """
+    Retira (e apaga) a mensagem estacionada mais antiga e devolve (chat_id, texto).
+    'SKIP LOCKED' deixa vários workers esvaziarem a fila sem pegar a mesma mensagem.
+    """
+    pending = (
+        db.query(models.PendingMessage)
+        .order_by(models.PendingMessage.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if not pending:
+        return None
+    # Lemos os campos antes do commit (depois dele o objeto já foi apagado)
+    chat_id, text = pending.chat_id, pending.text
+    db.delete(pending)
+    db.commit()
+    return chat_id, text
+
+def apply_funnel_stat_deltas(db: Session, deltas: dict[str, int]) -> None:
+    """
+    Soma um lote de variações aos contadores do funil, num único upsert.
+    """
+    if not deltas:
+        return
+    stmt = insert(models.FunnelStat).values([{"key": k, "value": v} for k, v in deltas.items()])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.FunnelStat.key],
+        set_={"value": models.FunnelStat.value + stmt.excluded.value}
+    )
+    db.execute(stmt)
+    db.commit()
+
+def replace_funnel_stats(db: Session, prefixes: tuple[str, ...], values: dict[str, int]) -> None:
+    """
+    Apaga os contadores que começam com 'prefixes' e grava 'values' no lugar,
+    numa única transação (usado pela reconstrução das estatísticas).
+    """
+    for prefix in prefixes:
+        db.query(models.FunnelStat).filter(models.FunnelStat.key.startswith(prefix)).delete(synchronize_session=False)
+    db.add_all(models.FunnelStat(key=k, value=v) for k, v in values.items())
+    db.commit()
+
+def clear_user_reminder(db: Session, user: models.User) -> models.User:
+    """Cancela os lembretes do usuário (ex: respondeu todas as perguntas)."""
+    user.next_reminder_at = None
+    user.reminders_sent = 0
     db.commit()
     db.refresh(user)
-    return user
\ No newline at end of file
+    return user
+
+def clear_reminder_by_chat_id(db: Session, chat_id: int) -> None:
+    """Cancela os lembretes de um chat (ex: o usuário bloqueou o bot)."""
+    db.query(models.User).filter(models.User.chat_id == chat_id).update(
+        {models.User.next_reminder_at: None}, synchronize_session=False
+    )
+    db.commit()
+
+def claim_due_reminders(db: Session, now: datetime, limit: int, max_reminders: int,
+                        stalled_hours: float, idle_hours: float) -> list[dict]:
+    """
+    Pega um lote de usuários com lembrete vencido (uma consulta no índice de
+    'next_reminder_at') e já reagenda o próximo lembrete de cada um, com o
+    intervalo dobrando a cada envio. Quem chegou em 'max_reminders' sai da fila.
+    'SKIP LOCKED' deixa vários workers dividirem o trabalho sem repetir usuários.
+    Retorna os dados necessários para enviar as mensagens.
+    """
+    users = (
+        db.query(models.User)
+        .filter(models.User.next_reminder_at <= now)
+        .order_by(models.User.next_reminder_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    due = []
+    for user in users:
+        due.append({
+            "chat_id": user.chat_id,
+            "first_name": user.first_name,
+            "user_state": user.user_state,
+            "current_question_id": user.current_question_id,
+        })
+        user.reminders_sent += 1
+        if user.reminders_sent >= max_reminders:
+            user.next_reminder_at = None
+        else:
+            base_hours = idle_hours if user.user_state == 'IDLE' else stalled_hours
+            user.next_reminder_at = now + timedelta(hours=base_hours * 2 ** user.reminders_sent)
+    db.commit()
+    return due
+
+def save_checkpoint(db: Session, checkpoint_id: int | None, chat_id: int, text: str,
+                    draft: str | None, analysis: str | None,
+                    question_id: int | None = None, user_state: str | None = None,
+                    voice_file_id: str | None = None) -> int:
+    """
+    Grava (ou atualiza, se 'checkpoint_id' já existir) um trabalho interrompido.
+    Retorna o id do checkpoint.
+    """
+    checkpoint = db.get(models.ConversationCheckpoint, checkpoint_id) if checkpoint_id else None
+    if checkpoint is None:
+        checkpoint = models.ConversationCheckpoint(chat_id=chat_id, text=text)
+        db.add(checkpoint)
+    checkpoint.text = text # Um áudio pode ter sido transcrito desde a última gravação
+    checkpoint.voice_file_id = voice_file_id
+    checkpoint.draft = draft
+    checkpoint.question_id = question_id
+    checkpoint.user_state = user_state
+    checkpoint.analysis = analysis
+    db.commit()
+    return checkpoint.id
+
+def set_checkpoint_analysis(db: Session, checkpoint_id: int, analysis: str) -> None:
+    """Guarda a resposta do Gemini que chegou depois do checkpoint ser gravado."""
+    db.query(models.ConversationCheckpoint).filter(models.ConversationCheckpoint.id == checkpoint_id).update(
+        {models.ConversationCheckpoint.analysis: analysis}, synchronize_session=False
+    )
+    db.commit()
+
+def delete_checkpoint(db: Session, checkpoint_id: int) -> None:
+    """Apaga um checkpoint (o trabalho foi concluído)."""
+    db.query(models.ConversationCheckpoint).filter(models.ConversationCheckpoint.id == checkpoint_id).delete(
+        synchronize_session=False
+    )
+    db.commit()
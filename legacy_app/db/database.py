@@ -1,16 +1,72 @@
 # legacy_app/db/database.py
+import threading
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 from legacy_app.core.config import settings # Importa nossas configurações!
 
+# 0. Um Pool que mede a espera por conexões
+# O QueuePool padrão não diz quanto tempo cada checkout ficou esperando
+# uma conexão livre. Medimos isso em volta do '_do_get' (onde ele espera).
+class PoolComMetricas(QueuePool):
+    """QueuePool que registra o tempo de espera de cada checkout."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._trava = threading.Lock() # Checkouts acontecem em várias threads ao mesmo tempo
+        self.checkouts = 0
+        self.espera_total = 0.0 # segundos
+        self.espera_maxima = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        inicio = time.monotonic()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            # Só o timeout do pool conta aqui (erros de conexão, por exemplo, não)
+            with self._trava:
+                self.timeouts += 1
+            raise
+        finally:
+            espera = time.monotonic() - inicio
+            with self._trava:
+                self.checkouts += 1
+                self.espera_total += espera
+                self.espera_maxima = max(self.espera_maxima, espera)
+
+    def metricas(self) -> dict:
+        """Uma foto consistente dos contadores de espera."""
+        with self._trava:
+            return {
+                "checkouts": self.checkouts,
+                "espera_media_s": round(self.espera_total / self.checkouts, 4) if self.checkouts else 0.0,
+                "espera_maxima_s": round(self.espera_maxima, 4),
+                "timeouts": self.timeouts,
+            }
+
+def criar_engine(url: str):
+    """Cria um Engine com o pool configurado pelo 'settings'."""
+    return create_engine(
+        url,
+        poolclass=PoolComMetricas,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=settings.DB_POOL_PRE_PING
+    )
+
 # 1. O Engine: A "ponte" entre SQLAlchemy e Postgres
 # Ele usa a URL que o 'settings' carregou do .env
-engine = create_engine(
-    settings.DATABASE_URL,
-    # 'pool_pre_ping' é uma boa prática para verificar
-    # conexões antes de usá-las.
-    pool_pre_ping=True 
-)
+engine = criar_engine(settings.DATABASE_URL)
+
+# 1b. O Engine de leitura: aponta para a réplica, se houver uma.
+# Sem réplica, a leitura usa o próprio primário.
+replica_engine = criar_engine(settings.DATABASE_REPLICA_URL) if settings.DATABASE_REPLICA_URL else engine
 
 # 2. A Fábrica de Sessões:
 # 'SessionLocal' é uma *classe*. Quando a chamamos,
@@ -21,6 +77,15 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+# 2b. A Fábrica de Sessões de LEITURA:
+# Para trabalho somente-leitura (perguntas, exportações, estatísticas).
+# Nunca use estas sessões para escrever!
+SessionLeitura = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=replica_engine
+)
+
 # 3. A Base dos Modelos:
 # Este objeto 'Base' é o "registro" central.
 # Quando movermos nosso 'models.py', faremos todas as nossas
@@ -42,6 +107,22 @@ def get_db():
     finally:
         db.close()
 
+def metricas_pool() -> dict:
+    """Uma foto do uso dos pools de conexão (primário e, se houver, réplica)."""
+    engines = {"primario": engine}
+    if replica_engine is not engine:
+        engines["replica"] = replica_engine
+
+    metricas = {}
+    for nome, eng in engines.items():
+        pool = eng.pool
+        metricas[f"pool_{nome}_em_uso"] = pool.checkedout()
+        metricas[f"pool_{nome}_livres"] = pool.checkedin()
+        metricas[f"pool_{nome}_overflow"] = pool.overflow()
+        for chave, valor in pool.metricas().items():
+            metricas[f"pool_{nome}_{chave}"] = valor
+    return metricas
+
 def init_db():
     """
     Cria todas as tabelas no banco de dados.
@@ -51,5 +132,9 @@ def init_db():
     # e garantir que os modelos sejam carregados antes de 'create_all'
     print("Inicializando o banco de dados e criando tabelas...")
     from . import models 
+    from . import migrations
     Base.metadata.create_all(bind=engine)
-    print("Tabelas criadas com sucesso (se não existiam).")
\ No newline at end of file
+    print("Tabelas criadas com sucesso (se não existiam).")
+    # Colunas/índices novos em tabelas antigas (o 'create_all' não faz isso)
+    migrations.migrar(engine)
+    print("Migrações aplicadas.")
\ No newline at end of file
@@ -0,0 +1,91 @@
+# legacy_app/db/migrations.py
+from sqlalchemy import text
+
+from legacy_app.core.config import settings
+
+# -----------------------------------------------------------------
+# MIGRAÇÕES (para bancos que já existiam)
+# -----------------------------------------------------------------
+# O 'create_all' só cria tabelas NOVAS: ele nunca adiciona colunas,
+# índices ou constraints numa tabela que já existe. Cada passo aqui é
+# idempotente ('IF NOT EXISTS'), então pode rodar em todo início do bot.
+
+def _coluna_existe(conexao, tabela: str, coluna: str) -> bool:
+    return conexao.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :tabela AND column_name = :coluna"
+    ), {"tabela": tabela, "coluna": coluna}).first() is not None
+
+def _adicionar_colunas_users(conexao):
+    """Colunas novas em 'users' (rascunho bruto e lembretes)."""
+    lembretes_novos = not _coluna_existe(conexao, "users", "next_reminder_at")
+    conexao.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS raw_cache TEXT"))
+    conexao.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS next_reminder_at TIMESTAMP WITH TIME ZONE"))
+    conexao.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS reminders_sent INTEGER NOT NULL DEFAULT 0"))
+    conexao.execute(text("CREATE INDEX IF NOT EXISTS ix_users_next_reminder_at ON users (next_reminder_at)"))
+    if lembretes_novos:
+        _agendar_lembretes_existentes(conexao)
+
+def _agendar_lembretes_existentes(conexao):
+    """
+    Só roda uma vez, quando as colunas de lembrete acabaram de ser criadas.
+    Sem isso, quem JÁ estava parado (o público dos lembretes) ficaria com
+    'next_reminder_at' NULL para sempre: só uma mudança de estado agenda.
+    Quem já respondeu todas as perguntas fica de fora.
+    """
+    agendados = conexao.execute(text(
+        "UPDATE users SET reminders_sent = 0, next_reminder_at = now() + "
+        "  CASE WHEN user_state = 'IDLE' THEN :horas_ocioso ELSE :horas_parado END * interval '1 hour' "
+        "WHERE next_reminder_at IS NULL "
+        "  AND (user_state <> 'IDLE' OR current_question_id <= (SELECT max(\"order\") FROM questions))"
+    ), {"horas_ocioso": settings.REMINDER_IDLE_HOURS, "horas_parado": settings.REMINDER_STALLED_HOURS}).rowcount
+    if agendados:
+        print(f"[Migração] Lembretes agendados para {agendados} usuário(s) que já existiam.")
+
+class MigracaoBloqueada(RuntimeError):
+    """A migração precisa de uma decisão do operador antes de continuar."""
+
+def _unicidade_story_chunks(conexao):
+    """
+    Uma história por (usuário, pergunta). Se já existem duplicatas, NÃO
+    apagamos nada (são histórias escritas pelos usuários): a migração para
+    e o operador decide quais ficam.
+    """
+    existe = conexao.execute(text("SELECT to_regclass('uq_story_chunks_user_question')")).scalar()
+    if existe:
+        return
+    duplicados = conexao.execute(text(
+        "SELECT count(*) FROM (SELECT 1 FROM story_chunks "
+        "GROUP BY user_id, question_id HAVING count(*) > 1) d"
+    )).scalar()
+    if duplicados:
+        raise MigracaoBloqueada(
+            f"'story_chunks' tem {duplicados} par(es) (user_id, question_id) com mais de uma história, "
+            "e o índice único 'uq_story_chunks_user_question' não pode ser criado. Nada foi apagado. "
+            "Veja os casos com: SELECT * FROM story_chunks WHERE (user_id, question_id) IN "
+            "(SELECT user_id, question_id FROM story_chunks GROUP BY 1, 2 HAVING count(*) > 1) "
+            "ORDER BY user_id, question_id, id; remova (ou arquive) as cópias e reinicie o bot."
+        )
+    conexao.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_story_chunks_user_question "
+        "ON story_chunks (user_id, question_id)"
+    ))
+
+def _adicionar_colunas_checkpoints(conexao):
+    """Pergunta e estado do usuário no momento do checkpoint (e o áudio ainda não transcrito)."""
+    conexao.execute(text("ALTER TABLE conversation_checkpoints ADD COLUMN IF NOT EXISTS question_id INTEGER"))
+    conexao.execute(text("ALTER TABLE conversation_checkpoints ADD COLUMN IF NOT EXISTS user_state VARCHAR(50)"))
+    conexao.execute(text("ALTER TABLE conversation_checkpoints ADD COLUMN IF NOT EXISTS voice_file_id VARCHAR(255)"))
+
+# A ordem importa: cada passo pode depender do anterior.
+PASSOS = [
+    _adicionar_colunas_users,
+    _unicidade_story_chunks,
+    _adicionar_colunas_checkpoints,
+]
+
+def migrar(engine):
+    """Roda todos os passos de migração numa única transação."""
+    with engine.begin() as conexao:
+        for passo in PASSOS:
+            passo(conexao)
@@ -1,5 +1,5 @@
 # legacy_app/db/models.py
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -23,11 +23,18 @@ class User(Base):
     user_state = Column(String(50), default='IDLE', nullable=False) 
     # Ex: 'IDLE', 'ANSWERING_Q15', 'REFINING_Q15'
     context_cache = Column(Text, nullable=True)
+    # O texto BRUTO (digitado ou transcrito) acumulado durante o refinamento.
+    # É ele que vai para 'StoryChunk.raw_transcription' quando a história é salva.
+    raw_cache = Column(Text, nullable=True)
     # Relacionamento virtual (não cria coluna)
     # Diz ao SQLAlchemy: "A classe 'StoryChunk' tem um atributo 'user'
     # que se refere a mim."
     story_chunks = relationship("StoryChunk", back_populates="user")
     refinement_attempts = Column(Integer, default=0, nullable=False)
+    # LEMBRETES: quando cutucar este usuário (NULL = nunca).
+    # Indexado: o agendador busca os vencidos com 'next_reminder_at <= agora'.
+    next_reminder_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    reminders_sent = Column(Integer, default=0, nullable=False) # Seguidos, sem resposta
             
 class Question(Base):
     """
@@ -45,6 +52,11 @@ class StoryChunk(Base):
     Modelo para cada "pedaço" de história contada pelo usuário.
     """
     __tablename__ = "story_chunks"
+    # Uma história por pergunta por usuário: se o mesmo update for processado
+    # duas vezes (reentrega do Telegram), o banco recusa o chunk duplicado.
+    __table_args__ = (
+        UniqueConstraint("user_id", "question_id", name="uq_story_chunks_user_question"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -54,4 +66,58 @@ class StoryChunk(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relacionamento: "Este 'StoryChunk' pertence a um 'User'"
-    user = relationship("User", back_populates="story_chunks")
\ No newline at end of file
+    user = relationship("User", back_populates="story_chunks")
+
+class UpdateWatermark(Base):
+    """
+    A "marca d'água" de cada worker do bot: o maior 'update_id' do Telegram
+    que ele já aceitou. Tudo que for menor ou igual é reentrega e é descartado.
+    """
+    __tablename__ = "update_watermarks"
+
+    worker_id = Column(String(100), primary_key=True)
+    last_update_id = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class PendingMessage(Base):
+    """
+    Mensagens "estacionadas" quando o bot está sobrecarregado.
+    São processadas em ordem (por 'id') assim que houver capacidade.
+    """
+    __tablename__ = "pending_messages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(BigInteger, nullable=False, index=True)
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class FunnelStat(Base):
+    """
+    Contadores agregados do "funil" de perguntas (ex: 'usuarios_na_q3', 'fugas_q3').
+    São mantidos de forma incremental pelo 'services/stats.py',
+    então ler as estatísticas nunca precisa varrer 'users' ou 'story_chunks'.
+    """
+    __tablename__ = "funnel_stats"
+
+    key = Column(String(100), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+class ConversationCheckpoint(Base):
+    """
+    Trabalho que não terminou a tempo quando o bot foi desligado.
+    No próximo início, o bot retoma daqui antes de aceitar mensagens novas.
+    """
+    __tablename__ = "conversation_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(BigInteger, nullable=False, index=True)
+    text = Column(Text, nullable=False)      # O texto (bruto) que o usuário mandou
+    draft = Column(Text, nullable=True)      # O rascunho ('context_cache') que foi para a análise
+    # Em que ponto da conversa o usuário estava quando o rascunho foi lido
+    question_id = Column(Integer, nullable=True)
+    user_state = Column(String(50), nullable=True)
+    # Áudio que ainda não tinha sido transcrito ('text' fica vazio): o
+    # 'file_id' do Telegram basta para baixá-lo de novo no próximo início
+    voice_file_id = Column(String(255), nullable=True)
+    analysis = Column(Text, nullable=True)   # A resposta do Gemini (JSON), se ela chegou
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
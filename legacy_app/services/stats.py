@@ -0,0 +1,143 @@
+# legacy_app/services/stats.py
+import asyncio
+import threading
+from collections import Counter
+
+# -----------------------------------------------------------------
+# 1. AS CHAVES (O "VOCABULÁRIO" DO FUNIL)
+# -----------------------------------------------------------------
+# Cada contador é uma linha em 'funnel_stats'. Por pergunta:
+#   usuarios_na_q{n}     -> usuários parados na pergunta n agora
+#   turnos_q{n}          -> quantas análises (turnos de refinamento) a pergunta n consumiu
+#   aprovadas_q{n}       -> histórias aprovadas pela IA
+#   fugas_q{n}           -> o usuário pediu para parar (STOPPING)
+#   rede_seguranca_q{n}  -> a rede de segurança (MAX_REFINEMENT_ATTEMPTS) disparou
+#   historias_salvas_q{n}-> StoryChunks gravados
+# E um total: historias_salvas
+
+USUARIOS_NA = "usuarios_na_q"
+TURNOS = "turnos_q"
+APROVADAS = "aprovadas_q"
+FUGAS = "fugas_q"
+REDE_SEGURANCA = "rede_seguranca_q"
+HISTORIAS_SALVAS_Q = "historias_salvas_q"
+HISTORIAS_SALVAS = "historias_salvas"
+
+# Os contadores que dá para recalcular a partir das tabelas.
+# Turnos, fugas, aprovações e rede de segurança não deixam rastro
+# no banco, então a reconstrução os preserva como estão.
+RECONSTRUIVEIS = (USUARIOS_NA, HISTORIAS_SALVAS_Q, HISTORIAS_SALVAS)
+
+def por_pergunta(prefixo: str, question_id: int) -> str:
+    """Monta a chave de um contador por pergunta (ex: 'fugas_q3')."""
+    return f"{prefixo}{question_id}"
+
+# -----------------------------------------------------------------
+# 2. O ACUMULADOR (incrementos na memória, gravados em lote)
+# -----------------------------------------------------------------
+class AcumuladorDeEstatisticas:
+    """
+    Guarda os incrementos na memória e os grava de uma vez no banco
+    ('flush'), em vez de fazer um UPDATE a cada evento.
+    """
+
+    def __init__(self):
+        self._pendentes = Counter()
+        self._trava = threading.Lock() # 'flush' roda numa thread separada
+
+    def incrementar(self, chave: str, delta: int = 1):
+        with self._trava:
+            self._pendentes[chave] += delta
+
+    def flush(self) -> int:
+        """Grava os incrementos pendentes. Retorna quantos contadores mudaram."""
+        from legacy_app.db import crud # Import tardio: 'crud' também importa este módulo
+        from legacy_app.db.database import SessionLocal
+
+        with self._trava:
+            lote = {k: v for k, v in self._pendentes.items() if v}
+            self._pendentes.clear()
+        if not lote:
+            return 0
+
+        db = SessionLocal()
+        try:
+            crud.apply_funnel_stat_deltas(db, lote)
+        except Exception:
+            # Não perdemos o lote: ele volta para a fila do próximo flush
+            db.rollback()
+            with self._trava:
+                self._pendentes.update(lote)
+            raise
+        finally:
+            db.close()
+        return len(lote)
+
+    async def flush_periodico(self, intervalo: float):
+        """Loop de fundo que chama o 'flush' a cada 'intervalo' segundos."""
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"[Estatísticas] Erro ao gravar os contadores: {e}")
+
+# A instância única usada pelo app
+acumulador = AcumuladorDeEstatisticas()
+
+def incrementar(chave: str, delta: int = 1):
+    """Atalho para 'acumulador.incrementar'."""
+    acumulador.incrementar(chave, delta)
+
+# -----------------------------------------------------------------
+# 3. LEITURA E RECONSTRUÇÃO
+# -----------------------------------------------------------------
+def ler(db) -> dict[str, int]:
+    """Lê os contadores agregados. Custo constante: não varre usuários nem histórias."""
+    from legacy_app.db import crud
+    return crud.get_funnel_stats(db)
+
+def reconstruir(db) -> dict[str, int]:
+    """
+    Recalcula do zero os contadores reconstruíveis (varre 'users' e 'story_chunks').
+    Use para backfill ou se os contadores ficarem fora de sincronia.
+    Rode com o bot parado: incrementos ainda não gravados seriam somados em dobro.
+    """
+    from legacy_app.db import crud
+
+    novos = {}
+    for question_id, total in crud.count_users_by_question(db).items():
+        novos[por_pergunta(USUARIOS_NA, question_id)] = total
+    chunks = crud.count_story_chunks_by_question(db)
+    for question_id, total in chunks.items():
+        novos[por_pergunta(HISTORIAS_SALVAS_Q, question_id)] = total
+    novos[HISTORIAS_SALVAS] = sum(chunks.values())
+
+    crud.replace_funnel_stats(db, RECONSTRUIVEIS, novos)
+    return novos
+
+def formatar(contadores: dict[str, int]) -> str:
+    """Transforma os contadores num relatório curto, uma linha por pergunta."""
+    colunas = [
+        ("usuários", USUARIOS_NA),
+        ("turnos", TURNOS),
+        ("aprovadas", APROVADAS),
+        ("fugas", FUGAS),
+        ("rede", REDE_SEGURANCA),
+        ("salvas", HISTORIAS_SALVAS_Q),
+    ]
+    perguntas = sorted({
+        int(chave[len(prefixo):])
+        for chave in contadores
+        for _, prefixo in colunas
+        if chave.startswith(prefixo) and chave[len(prefixo):].isdigit()
+    })
+
+    linhas = [f"Histórias salvas (total): {contadores.get(HISTORIAS_SALVAS, 0)}", ""]
+    for q in perguntas:
+        valores = ", ".join(f"{nome}={contadores.get(por_pergunta(prefixo, q), 0)}" for nome, prefixo in colunas)
+        turnos = contadores.get(por_pergunta(TURNOS, q), 0)
+        concluidas = sum(contadores.get(por_pergunta(p, q), 0) for p in (APROVADAS, FUGAS, REDE_SEGURANCA))
+        media = f", turnos/história={turnos / concluidas:.1f}" if concluidas else ""
+        linhas.append(f"Q{q}: {valores}{media}")
+    return "\n".join(linhas)
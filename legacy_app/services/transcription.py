@@ -0,0 +1,136 @@
+# legacy_app/services/transcription.py
+import asyncio
+import glob
+import importlib
+import multiprocessing
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from legacy_app.core.config import settings # Importamos nossas configs centrais
+
+# -----------------------------------------------------------------
+# 1. OS TRANSCRITORES (OS "OUVIDOS" DO BASTIÃO)
+# -----------------------------------------------------------------
+# Um transcritor é qualquer classe com:
+#   - __init__(self, modelo: str, idioma: str)
+#   - transcrever(self, caminho_wav: str) -> str
+# Ele roda DENTRO de um processo worker, nunca no event loop do bot.
+
+class FasterWhisperTranscritor:
+    """Transcritor local usando 'faster-whisper' (CTranslate2, roda bem em CPU)."""
+
+    def __init__(self, modelo: str, idioma: str):
+        from faster_whisper import WhisperModel # Import tardio: dependência opcional
+        self.modelo = WhisperModel(modelo, device="cpu", compute_type="int8")
+        self.idioma = idioma
+
+    def transcrever(self, caminho_wav: str) -> str:
+        segmentos, _info = self.modelo.transcribe(caminho_wav, language=self.idioma)
+        return " ".join(s.text.strip() for s in segmentos)
+
+class OpenAIWhisperTranscritor:
+    """Transcritor local usando o pacote 'openai-whisper' original."""
+
+    def __init__(self, modelo: str, idioma: str):
+        import whisper # Import tardio: dependência opcional
+        self.modelo = whisper.load_model(modelo)
+        self.idioma = idioma
+
+    def transcrever(self, caminho_wav: str) -> str:
+        resultado = self.modelo.transcribe(caminho_wav, language=self.idioma, fp16=False)
+        return resultado["text"].strip()
+
+# Apelidos aceitos em 'settings.TRANSCRIBER'
+TRANSCRITORES = {
+    "faster_whisper": "legacy_app.services.transcription:FasterWhisperTranscritor",
+    "whisper": "legacy_app.services.transcription:OpenAIWhisperTranscritor",
+}
+
+def carregar_classe_transcritor(nome: str) -> type:
+    """Resolve um apelido ou um caminho 'modulo:Classe' para a classe do transcritor."""
+    caminho = TRANSCRITORES.get(nome, nome)
+    modulo, _, classe = caminho.partition(":")
+    if not classe:
+        raise ValueError(f"Transcritor inválido: '{nome}'. Use um apelido ou 'modulo:Classe'.")
+    return getattr(importlib.import_module(modulo), classe)
+
+# -----------------------------------------------------------------
+# 2. O TRABALHO DOS WORKERS (roda em outro processo)
+# -----------------------------------------------------------------
+# Cada processo do pool carrega o modelo UMA VEZ (no 'initializer')
+# e o guarda nesta variável global do processo.
+_transcritor = None
+
+def _inicializar_worker(nome_transcritor: str, modelo: str, idioma: str):
+    global _transcritor
+    _transcritor = carregar_classe_transcritor(nome_transcritor)(modelo, idioma)
+
+def _decodificar_e_fatiar(caminho_audio: str, pasta_saida: str, segundos_por_trecho: int) -> list[str]:
+    """
+    Decodifica o áudio (ogg/opus, mp3, m4a...) com o ffmpeg para WAV mono 16kHz,
+    já fatiado em trechos de 'segundos_por_trecho'. Retorna os caminhos em ordem.
+    """
+    padrao_saida = os.path.join(pasta_saida, "trecho_%04d.wav")
+    subprocess.run(
+        [
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y",
+            "-i", caminho_audio,
+            "-ac", "1", "-ar", "16000",
+            "-f", "segment", "-segment_time", str(segundos_por_trecho),
+            padrao_saida,
+        ],
+        check=True,
+    )
+    return sorted(glob.glob(os.path.join(pasta_saida, "trecho_*.wav")))
+
+def _transcrever_trecho(caminho_wav: str) -> str:
+    return _transcritor.transcrever(caminho_wav)
+
+# -----------------------------------------------------------------
+# 3. O POOL DE PROCESSOS
+# -----------------------------------------------------------------
+_pool: ProcessPoolExecutor | None = None
+
+def get_pool() -> ProcessPoolExecutor:
+    """Cria o pool de processos na primeira utilização (e o reaproveita depois)."""
+    global _pool
+    if _pool is None:
+        print(f"Iniciando {settings.TRANSCRIPTION_WORKERS} worker(s) de transcrição ({settings.TRANSCRIBER})...")
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.TRANSCRIPTION_WORKERS,
+            # 'spawn' evita herdar as threads e o event loop do bot via fork()
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_inicializar_worker,
+            initargs=(settings.TRANSCRIBER, settings.WHISPER_MODEL, settings.TRANSCRIPTION_LANGUAGE),
+        )
+    return _pool
+
+def encerrar_pool():
+    """Encerra os workers de transcrição (chamado no desligamento do bot)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+# -----------------------------------------------------------------
+# 4. A FUNÇÃO DE SERVIÇO (O PONTO DE ENTRADA DO "GERENTE")
+# -----------------------------------------------------------------
+async def transcrever_audio(caminho_audio: str, pasta_trabalho: str) -> str:
+    """
+    Decodifica, fatia e transcreve um arquivo de áudio sem bloquear o event loop.
+    Os trechos são transcritos em paralelo e juntados na ordem original.
+    'pasta_trabalho' é uma pasta temporária que o chamador vai apagar depois.
+    """
+    print(f"--- Transcrevendo áudio {caminho_audio}... ---")
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+
+    trechos = await loop.run_in_executor(
+        pool, _decodificar_e_fatiar, caminho_audio, pasta_trabalho, settings.TRANSCRIPTION_CHUNK_SECONDS
+    )
+    textos = await asyncio.gather(
+        *(loop.run_in_executor(pool, _transcrever_trecho, trecho) for trecho in trechos)
+    )
+    print(f"--- Transcrição concluída ({len(trechos)} trecho(s)). ---")
+    return " ".join(t for t in textos if t).strip()
@@ -0,0 +1,156 @@
+# scripts/bench_reminders.py
+import argparse
+import random
+import sys
+import os
+import time
+from datetime import timedelta
+
+# --- CONFIGURAÇÃO DE CAMINHO (igual ao 'seed.py') ---
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+sys.path.append(project_root)
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from legacy_app.core.config import settings
+from legacy_app.db import crud
+from legacy_app.db.database import Base
+from legacy_app.db.models import User
+
+# -----------------------------------------------------------------
+# Benchmark do agendador de lembretes com uma tabela 'users' sintética.
+#
+# ATENÇÃO: rode contra um banco de TESTE (--url). O script cria usuários
+# falsos e os apaga no final. Para nunca tocar num usuário de verdade, os
+# falsos ficam numa faixa de 'chat_id' NEGATIVA (chats privados do Telegram
+# são sempre positivos) e têm o nome "Bench N"; a limpeza exige as duas coisas.
+# -----------------------------------------------------------------
+
+BASE_CHAT_ID = -2_000_000_000
+MAX_USUARIOS = 1_000_000 # A faixa é [BASE_CHAT_ID, BASE_CHAT_ID + MAX_USUARIOS)
+
+def popular(Session, total: int, fracao_vencida: float):
+    """Insere 'total' usuários; 'fracao_vencida' deles com lembrete já vencido."""
+    agora = crud.utcnow()
+    db = Session()
+    try:
+        lote = []
+        for i in range(total):
+            if random.random() < fracao_vencida:
+                vencimento = agora - timedelta(minutes=random.randint(1, 600))
+            elif random.random() < 0.5:
+                vencimento = agora + timedelta(hours=random.uniform(0, 72))
+            else:
+                vencimento = None # Já recebeu todos os lembretes / terminou
+            lote.append({
+                "chat_id": BASE_CHAT_ID + i,
+                "first_name": f"Bench {i}",
+                "current_question_id": random.randint(1, 15),
+                "user_state": random.choice(["IDLE", "CONVERSANDO_Q3", "CONVERSANDO_Q7"]),
+                "refinement_attempts": 0,
+                "reminders_sent": 0,
+                "next_reminder_at": vencimento,
+            })
+            if len(lote) == 10_000:
+                db.execute(User.__table__.insert(), lote)
+                lote = []
+        if lote:
+            db.execute(User.__table__.insert(), lote)
+        db.commit()
+        db.execute(text("ANALYZE users"))
+        db.commit()
+    finally:
+        db.close()
+
+def limpar(Session):
+    """Apaga só os usuários que este script cria (faixa de 'chat_id' E nome)."""
+    db = Session()
+    try:
+        db.query(User).filter(
+            User.chat_id >= BASE_CHAT_ID,
+            User.chat_id < BASE_CHAT_ID + MAX_USUARIOS,
+            User.first_name.like("Bench %"),
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def mostrar_plano(Session):
+    """Mostra o plano da consulta de vencidos (deve usar o índice de 'next_reminder_at')."""
+    db = Session()
+    try:
+        plano = db.execute(text(
+            "EXPLAIN SELECT * FROM users WHERE next_reminder_at <= now() "
+            "ORDER BY next_reminder_at LIMIT :n FOR UPDATE SKIP LOCKED"
+        ), {"n": settings.REMINDER_BATCH_SIZE})
+        print("Plano da consulta de vencidos:")
+        for (linha,) in plano:
+            print(f"   {linha}")
+    finally:
+        db.close()
+
+def medir(Session):
+    db = Session()
+    try:
+        # 1. Carregar a roda (próxima volta)
+        inicio = time.perf_counter()
+        ate = crud.utcnow() + timedelta(seconds=settings.REMINDER_WHEEL_SLOTS * settings.REMINDER_TICK_SECONDS)
+        horarios = crud.get_upcoming_reminder_times(db, until=ate, limit=settings.REMINDER_BATCH_SIZE)
+        print(f"Carregar a roda: {(time.perf_counter() - inicio) * 1000:.1f} ms ({len(horarios)} horários)")
+
+        # 2. Esvaziar todos os vencidos, em lotes (sem enviar mensagens)
+        lotes, usuarios, tempos = 0, 0, []
+        inicio_total = time.perf_counter()
+        while True:
+            inicio = time.perf_counter()
+            lote = crud.claim_due_reminders(
+                db,
+                now=crud.utcnow(),
+                limit=settings.REMINDER_BATCH_SIZE,
+                max_reminders=settings.REMINDER_MAX_PER_USER,
+                stalled_hours=settings.REMINDER_STALLED_HOURS,
+                idle_hours=settings.REMINDER_IDLE_HOURS,
+            )
+            tempos.append(time.perf_counter() - inicio)
+            if not lote:
+                break
+            lotes += 1
+            usuarios += len(lote)
+        total = time.perf_counter() - inicio_total
+        tempos.sort()
+        print(f"Vencidos processados: {usuarios} em {lotes} lote(s), {total:.2f} s "
+              f"({usuarios / total:.0f} usuários/s)")
+        print(f"Latência por lote: mediana {tempos[len(tempos) // 2] * 1000:.1f} ms, "
+              f"máxima {tempos[-1] * 1000:.1f} ms")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do agendador de lembretes.")
+    parser.add_argument("--url", required=True, help="URL de um banco de TESTE (nunca o de produção!)")
+    parser.add_argument("--usuarios", type=int, default=300_000, help="Quantos usuários sintéticos criar")
+    parser.add_argument("--vencidos", type=float, default=0.05, help="Fração de usuários com lembrete vencido")
+    args = parser.parse_args()
+    if args.usuarios > MAX_USUARIOS:
+        parser.error(f"--usuarios deve ser no máximo {MAX_USUARIOS}.")
+    if args.url == settings.DATABASE_URL:
+        parser.error("--url é o banco do bot (DATABASE_URL). Use um banco de TESTE.")
+
+    engine = create_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    limpar(Session) # Restos de uma execução anterior
+    print(f"Criando {args.usuarios} usuários sintéticos...")
+    inicio = time.perf_counter()
+    popular(Session, args.usuarios, args.vencidos)
+    print(f"Usuários criados em {time.perf_counter() - inicio:.1f} s.")
+
+    try:
+        mostrar_plano(Session)
+        medir(Session)
+    finally:
+        print("Apagando os usuários sintéticos...")
+        limpar(Session)
@@ -0,0 +1,51 @@
+# scripts/stats.py
+import argparse
+import sys
+import os
+
+# --- CONFIGURAÇÃO DE CAMINHO (igual ao 'seed.py') ---
+# Adiciona a pasta raiz do projeto ao sys.path para podermos importar 'legacy_app'.
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+sys.path.append(project_root)
+
+from legacy_app.db.database import SessionLocal, SessionLeitura
+from legacy_app.services import stats
+
+# -----------------------------------------------------------------
+
+def mostrar():
+    """Mostra o funil lendo só a tabela agregada (na réplica, se houver)."""
+    db = SessionLeitura()
+    try:
+        print(stats.formatar(stats.ler(db)))
+    finally:
+        db.close()
+
+def reconstruir():
+    """Recalcula do zero os contadores que podem ser derivados das tabelas."""
+    print("Reconstruindo as estatísticas (varredura completa de 'users' e 'story_chunks')...")
+    # A reconstrução escreve, então vai no primário
+    db = SessionLocal()
+    try:
+        novos = stats.reconstruir(db)
+        print(f"Sucesso! {len(novos)} contadores recalculados.")
+    except Exception as e:
+        print(f"Erro ao reconstruir as estatísticas: {e}")
+        db.rollback()
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estatísticas do funil de perguntas do Projeto Legado.")
+    parser.add_argument(
+        "comando", choices=["mostrar", "reconstruir"], nargs="?", default="mostrar",
+        help="'mostrar' lê os contadores; 'reconstruir' recalcula do zero (rode com o bot parado)."
+    )
+    args = parser.parse_args()
+
+    if args.comando == "reconstruir":
+        reconstruir()
+    else:
+        mostrar()